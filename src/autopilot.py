@@ -1,13 +1,79 @@
-import queue
+import time
 import logging
 import threading
 import libevdev
+import numpy as np
+from pid import PIDController
+from profiler import Profiler
+
+
+# Axes driven by the autopilot, in the order of the per-axis settings.
+AXES = (
+    libevdev.EV_ABS.ABS_Y,
+    libevdev.EV_ABS.ABS_X,
+    libevdev.EV_ABS.ABS_RX,
+    libevdev.EV_ABS.ABS_Z,
+)
+
+AXIS_MIN = 0
+AXIS_MAX = 2047
+AXIS_CENTER = 1023
+
+
+class Mailbox:
+    """
+    Single-slot channel that only keeps the most recent value.
+
+    Putting a value overwrites the previous one if it was not taken yet,
+    so a slow consumer always acts on the latest value.
+    """
+
+    def __init__(self):
+        self._value = None
+        self._dropped = 0
+        self._condition = threading.Condition()
+
+    def put(self, value):
+        with self._condition:
+            if self._value is not None:
+                self._dropped += 1
+
+            self._value = value
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self._value is not None, timeout)
+
+            value = self._value
+            self._value = None
+
+            return value
+
+    def clear(self):
+        with self._condition:
+            self._value = None
+
+    def get_dropped(self):
+        with self._condition:
+            return self._dropped
 
 
 class Autopilot:
-    def __init__(self, simulator, resolution):
+    """
+    Steers towards the tracked target at a fixed control rate.
+
+    Each target carries the capture time of its frame; the control loop
+    extrapolates the latest one to the present with the target's
+    image-plane velocity, and a PID controller per axis turns its
+    offset from the image center into stick positions.
+    """
+
+    def __init__(self, simulator, resolution, config, profiler=None, recorder=None):
         self._simulator = simulator
-        self._queue = queue.Queue()
+        self._profiler = profiler or Profiler()
+        self._recorder = recorder
+        self._mailbox = Mailbox()
         width, height = resolution
 
         self._center = {
@@ -18,12 +84,48 @@ class Autopilot:
         self._is_running = threading.Event()
         self._is_enabled = False
 
+        # The target state is only touched by the control thread; other
+        # threads ask it to forget the target through this flag.
+        self._is_reset_requested = threading.Event()
+
+        self._control_period = 1.0 / config["CONTROL_RATE"]
+        self._max_prediction = config["MAX_PREDICTION"]
+        self._velocity_smoothing = config["VELOCITY_SMOOTHING"]
+        self._target_timeout = config["TARGET_TIMEOUT"]
+
+        # The gains are given in stick deflections per normalized error,
+        # the controller works in axis units.
+        axis_scale = AXIS_CENTER
+
+        self._pid = PIDController(
+            np.asarray(config["KP"]) * axis_scale,
+            np.asarray(config["KI"]) * axis_scale,
+            np.asarray(config["KD"]) * axis_scale,
+            self._control_period,
+            offset=AXIS_CENTER + np.asarray(config["BIAS"]) * axis_scale,
+            output_min=AXIS_MIN,
+            output_max=AXIS_MAX,
+            integral_limit=config["INTEGRAL_LIMIT"],
+            derivative_filter=config["DERIVATIVE_FILTER"],
+            rate_limit=config["RATE_LIMIT"] * axis_scale,
+        )
+
+        self._error = np.zeros(len(AXES))
+
+        # Stick positions with no error, sent once when steering stops so
+        # the last deflections don't stay latched in the controller.
+        self._neutral = np.clip(AXIS_CENTER + np.asarray(config["BIAS"]) * axis_scale, AXIS_MIN, AXIS_MAX)
+        self._is_steering = False
+
+        self._target = None
+        self._target_id = None
         self._target_size = None
         self._deadzone = 0.02
-        self._smoothing = 0.4
 
-        self._s_dx = 0
-        self._s_dy = 0
+        self._vx = 0
+        self._vy = 0
+
+        self._target_age = None
 
     def run(self):
         thread = threading.Thread(target=self._run, daemon=True)
@@ -32,46 +134,138 @@ class Autopilot:
     def _run(self):
         try:
             self._is_running.set()
+            next_tick = time.monotonic()
 
             while self._is_running.is_set():
-                target = self._queue.get()
+                next_tick += self._control_period
+                delay = next_tick - time.monotonic()
 
-                if self._target_size is None:
-                    self._target_size = target["size"]
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind; skip the missed ticks instead of bursting.
+                    next_tick = time.monotonic()
 
-                dx = target["x"] - self._center["x"]
-                dy = target["y"] - self._center["y"] + target["size"] / 2
-                ds = target["size"] - self._target_size
+                with self._profiler.span("control"):
+                    self._control_step(time.monotonic())
+        except Exception as error:
+            logging.error(error)
+        finally:
+            self.stop()
 
-                self._s_dx = (1 - self._smoothing) * dx + self._smoothing * self._s_dx
-                self._s_dy = (1 - self._smoothing) * dy + self._smoothing * self._s_dy
+    def _control_step(self, now):
+        if self._is_reset_requested.is_set():
+            self._is_reset_requested.clear()
+            self._clear_target()
 
-                nx = self._s_dx / self._center["x"]
-                ny = self._s_dy / self._center["y"]
-                ns = ds / self._center["y"]
+        if not self._is_enabled:
+            self._release_sticks()
+            return
 
-                if abs(ny) < self._deadzone:
-                    ny = 0
+        target = self._mailbox.get(0)
 
-                throttle = -(ny + ns + 0.05)
+        if target is not None:
+            self._observe_target(target)
 
-                self._send_event(libevdev.EV_ABS.ABS_Y, ny)
-                self._send_event(libevdev.EV_ABS.ABS_X, nx)
-                self._send_event(libevdev.EV_ABS.ABS_RX, nx)
-                self._send_event(libevdev.EV_ABS.ABS_Z, throttle)
-        except Exception as error:
-            logging.error(error)
-        finally:
-            self.stop()
+        target = self._target
+        target_size = self._target_size
+
+        if target is None:
+            self._release_sticks()
+            return
+
+        target_age = now - target["timestamp"]
+        self._target_age = target_age
+
+        if target_age > self._target_timeout:
+            self._release_sticks()
+            return
+
+        # Extrapolate the target to the present to make up for the
+        # decoding, tracking and queueing delay since its capture.
+        horizon = min(target_age, self._max_prediction)
+
+        x = target["x"] + self._vx * horizon
+        y = target["y"] + self._vy * horizon
+
+        dx = x - self._center["x"]
+        dy = y - self._center["y"] + target["size"] / 2
+        ds = target["size"] - target_size
+
+        nx = dx / self._center["x"]
+        ny = dy / self._center["y"]
+        ns = ds / self._center["y"]
+
+        if abs(ny) < self._deadzone:
+            ny = 0
+
+        self._error[0] = ny
+        self._error[1] = nx
+        self._error[2] = nx
+        self._error[3] = -(ny + ns)
+
+        self._send_events(self._pid.update(self._error))
+        self._is_steering = True
+
+        # Capture of the frame to stick event.
+        self._profiler.record("end_to_end", time.monotonic() - target["timestamp"])
+        self._profiler.set_gauge("dropped_targets", self._mailbox.get_dropped())
+
+    def _release_sticks(self):
+        self._pid.reset()
 
-    def _send_event(self, code, coef):
-        value = int(1023 + coef * 1023)
-        event = libevdev.InputEvent(code, value)
-        self._simulator.send_event(event)
+        if self._is_steering:
+            self._is_steering = False
+            self._send_events(self._neutral)
+
+    def _observe_target(self, target):
+        if target.get("id") != self._target_id:
+            # Another target was selected; its size is the new reference.
+            self._clear_target()
+            self._target_id = target.get("id")
+
+        if self._target is not None:
+            dt = target["timestamp"] - self._target["timestamp"]
+
+            if dt > 0:
+                vx = (target["x"] - self._target["x"]) / dt
+                vy = (target["y"] - self._target["y"]) / dt
+
+                self._vx = (1 - self._velocity_smoothing) * vx + self._velocity_smoothing * self._vx
+                self._vy = (1 - self._velocity_smoothing) * vy + self._velocity_smoothing * self._vy
+
+        self._target = target
+
+        if self._target_size is None:
+            self._target_size = target["size"]
+
+    def _send_events(self, values):
+        events = []
+
+        for code, value in zip(AXES, values):
+            events.append(libevdev.InputEvent(code, int(value)))
+
+        self._simulator.send_events(events)
+
+        if self._recorder is not None:
+            self._recorder.record_control(time.monotonic(), values)
+
+    def _clear_target(self):
+        self._target = None
+        self._target_id = None
+        self._target_size = None
+        self._vx = 0
+        self._vy = 0
 
     def update_target(self, target):
         if self._is_enabled:
-            self._queue.put(target)
+            self._mailbox.put(target)
+
+    def get_stats(self):
+        return {
+            "target_age": self._target_age,
+            "dropped_targets": self._mailbox.get_dropped(),
+        }
 
     def is_enabled(self):
         return self._is_enabled
@@ -81,9 +275,8 @@ class Autopilot:
 
     def disable(self):
         self._is_enabled = False
-        self._target_size = None
-        self._s_dx = 0
-        self._s_dy = 0
+        self._mailbox.clear()
+        self._is_reset_requested.set()
 
     def stop(self):
         if not self._is_running.is_set():
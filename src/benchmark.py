@@ -0,0 +1,223 @@
+import cv2
+import time
+import argparse
+import itertools
+import numpy as np
+from camera import Frame
+from profiler import Profiler
+from tracker import IncrementalTracker, TargetSink
+from config import TRACKER_CONFIG, VIDEO_RESOLUTION
+
+
+# Mean time per call: "model_update" runs once per batch of frames,
+# possibly on the update worker, the other stages once per frame.
+STAGES = ("grayscale", "resample", "warp", "likelihood", "sklm", "model_update")
+
+
+class SyntheticVideo:
+    """
+    Procedurally generated frames of a textured target moving over a
+    textured background, with the target center as ground truth.
+    """
+
+    def __init__(self, resolution, target_size, speed, seed=0):
+        self._width, self._height = resolution
+        self._target_size = target_size
+        self._speed = speed
+
+        rng = np.random.default_rng(seed)
+
+        background = rng.integers(0, 256, (self._height // 8, self._width // 8, 3), dtype=np.uint8)
+        self._background = cv2.resize(background, resolution, interpolation=cv2.INTER_CUBIC)
+
+        target = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        self._target = cv2.resize(target, (target_size, target_size), interpolation=cv2.INTER_NEAREST)
+
+        self._frame = np.empty_like(self._background)
+        self._frame_id = 0
+        self.ground_truth = None
+
+        self.advance()
+
+    def get_resolution(self):
+        return self._width, self._height
+
+    def get_scale(self):
+        return 1.0, 1.0
+
+    def advance(self):
+        t = self._frame_id * self._speed / 60
+
+        x = self._width / 2 + 0.3 * self._width * np.sin(t)
+        y = self._height / 2 + 0.2 * self._height * np.sin(0.7 * t)
+
+        left = int(round(x)) - self._target_size // 2
+        top = int(round(y)) - self._target_size // 2
+
+        np.copyto(self._frame, self._background)
+        self._frame[top:top + self._target_size, left:left + self._target_size] = self._target
+
+        self._frame_id += 1
+        self.ground_truth = (left + self._target_size // 2, top + self._target_size // 2)
+
+        return True
+
+    def lease(self):
+        return Frame(None, None, self._frame, self._frame_id, time.monotonic())
+
+
+class RecordedVideo:
+    """
+    Frames read from a video file, or from a raw bgr24 file when
+    a resolution is given. There is no ground truth.
+    """
+
+    def __init__(self, path, resolution=None):
+        self._resolution = resolution
+        self._frame_id = 0
+        self._frame = None
+        self.ground_truth = None
+
+        if resolution is None:
+            self._capture = cv2.VideoCapture(path)
+
+            width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self._resolution = (width, height)
+        else:
+            self._capture = None
+            self._file = open(path, "rb")
+
+            width, height = resolution
+            self._frame = np.empty((height, width, 3), dtype=np.uint8)
+
+        self.advance()
+
+    def get_resolution(self):
+        return self._resolution
+
+    def get_scale(self):
+        return 1.0, 1.0
+
+    def advance(self):
+        if self._capture is not None:
+            ok, frame = self._capture.read()
+
+            if not ok:
+                return False
+
+            self._frame = frame
+        elif self._file.readinto(memoryview(self._frame).cast("B")) < self._frame.nbytes:
+            return False
+
+        self._frame_id += 1
+        return True
+
+    def lease(self):
+        return Frame(None, None, self._frame, self._frame_id, time.monotonic())
+
+
+def run_benchmark(video, config, frames, initial_size):
+    profiler = Profiler(enabled=True, window=None)
+    sink = TargetSink()
+    tracker = IncrementalTracker(video, sink, sink, config, profiler)
+
+    width, height = video.get_resolution()
+    tracker.set_initial_box({"x": width // 2, "y": height // 2, "size": initial_size})
+    tracker.init()
+
+    errors = []
+    elapsed = 0.0
+
+    for _ in range(frames):
+        if not video.advance():
+            break
+
+        frame = video.lease()
+
+        start_time = time.perf_counter()
+        est = tracker.process(frame)
+        elapsed += time.perf_counter() - start_time
+
+        if video.ground_truth is not None:
+            errors.append(np.hypot(est[0] - video.ground_truth[0], est[1] - video.ground_truth[1]))
+
+    summary = profiler.summary()
+    processed = summary["warp"]["count"] if "warp" in summary else 0
+
+    result = {
+        "fps": processed / elapsed if elapsed > 0 else 0.0,
+        "stages": {name: summary[name]["mean"] * 1000 for name in STAGES if name in summary},
+        "error_mean": float(np.mean(errors)) if errors else None,
+        "error_max": float(np.max(errors)) if errors else None,
+    }
+
+    return result
+
+
+def format_result(params, result):
+    columns = [f"{name}={value}" for name, value in params.items()]
+    columns.append(f"fps={result['fps']:.1f}")
+
+    for name in STAGES:
+        if name in result["stages"]:
+            columns.append(f"{name}={result['stages'][name]:.2f}ms")
+
+    if result["error_mean"] is not None:
+        columns.append(f"err={result['error_mean']:.1f}px")
+        columns.append(f"err_max={result['error_max']:.1f}px")
+
+    return " ".join(columns)
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless tracker benchmark")
+    parser.add_argument("--video", help="video file, or raw bgr24 file with --resolution")
+    parser.add_argument("--resolution", type=parse_list, help="width,height of a raw video")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--target-size", type=int, default=48)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--nparticles", type=parse_list, default=[TRACKER_CONFIG["NPARTICLES"]])
+    parser.add_argument("--template-size", type=parse_list, default=[TRACKER_CONFIG["TEMPLATE_SIZE"]])
+    parser.add_argument("--max-basis", type=parse_list, default=[TRACKER_CONFIG["MAX_BASIS"]])
+    parser.add_argument("--frame-budget", type=float, help="adaptive particle count budget, in ms")
+    args = parser.parse_args()
+
+    sweep = itertools.product(args.nparticles, args.template_size, args.max_basis)
+
+    for nparticles, template_size, max_basis in sweep:
+        if args.video is None:
+            video = SyntheticVideo(VIDEO_RESOLUTION, args.target_size, args.speed, args.seed)
+        else:
+            video = RecordedVideo(args.video, args.resolution)
+
+        config = dict(TRACKER_CONFIG)
+        config["NPARTICLES"] = nparticles
+        config["TEMPLATE_SIZE"] = template_size
+        config["MAX_BASIS"] = max_basis
+        config["SEED"] = args.seed
+
+        if args.frame_budget is not None:
+            config["ADAPTIVE_PARTICLES"] = True
+            config["FRAME_BUDGET"] = args.frame_budget / 1000
+
+        params = {
+            "nparticles": nparticles,
+            "template_size": template_size,
+            "max_basis": max_basis,
+        }
+
+        if args.frame_budget is not None:
+            params["frame_budget"] = f"{args.frame_budget}ms"
+
+        result = run_benchmark(video, config, args.frames, args.target_size)
+        print(format_result(params, result))
+
+
+if __name__ == "__main__":
+    main()
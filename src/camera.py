@@ -1,67 +1,475 @@
+import os
+import cv2
+import time
 import logging
 import threading
 import subprocess
 import numpy as np
+from profiler import Profiler
 
 
-class VirtualCamera:
-    def __init__(self, stream_url, resolution):
+DECODER_BACKENDS = {
+    "cuda": ["-hwaccel", "cuda"],
+    "vaapi": ["-hwaccel", "vaapi"],
+    "qsv": ["-hwaccel", "qsv"],
+    "cpu": [],
+}
+
+PIXEL_FORMAT_CHANNELS = {
+    "bgr24": 3,
+    "gray": 1,
+}
+
+
+def detect_decoder(preferred="auto"):
+    """
+    Pick the decoder backend to use.
+
+    With "auto", the hardware backends are probed in order by asking
+    ffmpeg to initialize their device, falling back to the libavcodec
+    software decoder when none is available.
+    """
+
+    if preferred != "auto":
+        return preferred
+
+    for name, args in DECODER_BACKENDS.items():
+        if not args:
+            continue
+
+        if _is_hardware_device_available(name):
+            return name
+
+    return "cpu"
+
+
+def _is_hardware_device_available(name):
+    command = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-init_hw_device", name,
+        "-f", "lavfi",
+        "-i", "nullsrc",
+        "-frames:v", "1",
+        "-f", "null",
+        "-",
+    ]
+
+    try:
+        result = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+    return result.returncode == 0
+
+
+class Frame:
+    def __init__(self, stream, slot, image, frame_id, timestamp, luma=None):
+        self._stream = stream
+        self._slot = slot
+
+        self.image = image
+        self.luma = luma
+        self.id = frame_id
+        self.timestamp = timestamp
+
+    def release(self):
+        if self._stream is None:
+            return
+
+        self._stream.release(self._slot)
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class FrameStream:
+    """
+    Ring of preallocated frame buffers filled in place from one raw
+    ffmpeg output, with frame leasing and new-frame notification.
+
+    With `publish_luma`, the reader thread also converts every frame once
+    into a float32 luminance plane in [0, 1], stored next to the raw frame
+    and shared by reference with all consumers.
+
+    Each of the `consumers` holds at most one lease at a time, so the ring
+    needs a slot per consumer besides the latest frame and the one being
+    filled; with fewer, new frames are dropped while consumers keep
+    seeing a stale one.
+
+    Stage timings and counters are reported to `profiler` under `name`.
+    """
+
+    def __init__(
+        self,
+        resolution,
+        pixel_format,
+        ring_size,
+        scale=(1.0, 1.0),
+        publish_luma=False,
+        name="camera",
+        profiler=None,
+        consumers=2,
+    ):
+        if ring_size < consumers + 2:
+            raise ValueError(f"A ring of {ring_size} frames is too small for {consumers} consumers, use {consumers + 2}")
+
         self._width, self._height = resolution
-        self._current_frame = None
+        self._pixel_format = pixel_format
+        self._scale = scale
+
+        self._name = name
+        self._profiler = profiler or Profiler()
+
+        channels = PIXEL_FORMAT_CHANNELS[pixel_format]
+
+        if channels == 1:
+            self._frame_shape = (self._height, self._width)
+        else:
+            self._frame_shape = (self._height, self._width, channels)
+
+        self._buffers = np.zeros((ring_size, *self._frame_shape), dtype=np.uint8)
+        self._discard_buffer = np.zeros(self._frame_shape, dtype=np.uint8)
+
+        self._luma_buffers = None
+        self._gray_buffer = None
+
+        if publish_luma:
+            luma_shape = (ring_size, self._height, self._width)
+            self._luma_buffers = np.zeros(luma_shape, dtype=np.float32)
+
+            if channels > 1:
+                self._gray_buffer = np.zeros((self._height, self._width), dtype=np.uint8)
+
+        self._leases = [0] * ring_size
+        self._latest_slot = None
+        self._frame_id = 0
+        self._timestamp = None
+        self._dropped_frames = 0
 
         self._lock = threading.Lock()
-        self._is_running = threading.Event()
+        self._new_frame = threading.Condition(self._lock)
+
+    def read_from(self, stream, is_running):
+        while is_running.is_set():
+            slot = self._acquire_slot()
+
+            if slot is None:
+                buffer = self._discard_buffer
+            else:
+                buffer = self._buffers[slot]
+
+            with self._profiler.span(f"{self._name}_read"):
+                is_read = self._read_into(stream, buffer)
+
+            if not is_read:
+                # Nothing was published into the slot, give back its hold.
+                if slot is not None:
+                    self.release(slot)
+
+                break
+
+            timestamp = time.monotonic()
+
+            if slot is not None and self._luma_buffers is not None:
+                with self._profiler.span(f"{self._name}_luma"):
+                    self._convert_luma(buffer, self._luma_buffers[slot])
+
+            with self._lock:
+                if slot is None:
+                    self._dropped_frames += 1
+                    self._profiler.increment(f"{self._name}_dropped_frames")
+                    continue
+
+                self._profiler.increment(f"{self._name}_frames")
+
+                self._leases[slot] -= 1
+                self._latest_slot = slot
+                self._frame_id += 1
+                self._timestamp = timestamp
+
+                self._new_frame.notify_all()
+
+    def _acquire_slot(self):
+        with self._lock:
+            for offset in range(1, len(self._leases) + 1):
+                slot = ((self._latest_slot or 0) + offset) % len(self._leases)
+
+                if slot != self._latest_slot and self._leases[slot] == 0:
+                    # Hold the slot while it is being filled.
+                    self._leases[slot] += 1
+                    return slot
+
+        return None
+
+    def _convert_luma(self, frame, luma):
+        if self._gray_buffer is not None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray_buffer)
+            frame = self._gray_buffer
+
+        np.multiply(frame, np.float32(1.0 / 255.0), out=luma)
+
+    def _read_into(self, stream, buffer):
+        view = memoryview(buffer).cast("B")
+        position = 0
+
+        while position < view.nbytes:
+            count = stream.readinto(view[position:])
+
+            if not count:
+                return False
+
+            position += count
+
+        return True
+
+    def lease(self):
+        """
+        Borrow the most recent frame without copying it.
+
+        The returned frame holds a read-only view into the ring buffer;
+        its slot is not overwritten until `Frame.release` is called.
+        """
+
+        with self._lock:
+            return self._lease_latest()
+
+    def wait_for_frame(self, after_id, timeout=None):
+        """
+        Block until a frame newer than `after_id` arrives and lease it.
+
+        Returns None if no new frame arrived within `timeout` seconds.
+        """
+
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self._frame_id > after_id, timeout)
+
+            if self._frame_id <= after_id:
+                return None
 
+            return self._lease_latest()
+
+    def _lease_latest(self):
+        if self._latest_slot is None:
+            return None
+
+        slot = self._latest_slot
+        self._leases[slot] += 1
+
+        image = self._buffers[slot].view()
+        image.flags.writeable = False
+
+        luma = None
+
+        if self._luma_buffers is not None:
+            luma = self._luma_buffers[slot].view()
+            luma.flags.writeable = False
+
+        return Frame(self, slot, image, self._frame_id, self._timestamp, luma)
+
+    def release(self, slot):
+        with self._lock:
+            self._leases[slot] -= 1
+
+    def read(self):
+        frame = self.lease()
+
+        if frame is None:
+            return None
+
+        with frame, self._profiler.span(f"{self._name}_copy"):
+            return frame.image.copy()
+
+    def get_frame_id(self):
+        with self._lock:
+            return self._frame_id
+
+    def get_dropped_frames(self):
+        with self._lock:
+            return self._dropped_frames
+
+    def get_pixel_format(self):
+        return self._pixel_format
+
+    def get_resolution(self):
+        return self._width, self._height
+
+    def get_scale(self):
+        """
+        Factors that map this stream's pixel coordinates to the
+        display resolution.
+        """
+
+        return self._scale
+
+
+class VirtualCamera:
+    def __init__(
+        self,
+        stream_url,
+        resolution,
+        ring_size=4,
+        decoder="auto",
+        pixel_format="bgr24",
+        tracking_resolution=None,
+        publish_luma=True,
+        profiler=None,
+    ):
+        self._width, self._height = resolution
+        self._stream_url = stream_url
+        self._decoder = decoder
+
+        self._tracking = None
+
+        if tracking_resolution is None:
+            self._display = FrameStream(
+                resolution,
+                pixel_format,
+                ring_size,
+                publish_luma=publish_luma,
+                name="camera",
+                profiler=profiler,
+            )
+        else:
+            self._display = FrameStream(resolution, pixel_format, ring_size, name="camera", profiler=profiler)
+
+            tracking_width, tracking_height = tracking_resolution
+            scale = (self._width / tracking_width, self._height / tracking_height)
+
+            self._tracking = FrameStream(
+                tracking_resolution,
+                "gray",
+                ring_size,
+                scale,
+                publish_luma,
+                name="tracking_camera",
+                profiler=profiler,
+            )
+
+        self._is_running = threading.Event()
         self._ffmpeg_process = None
-        self._ffmpeg_command = [
-            "ffmpeg",
-            "-c:v", "hevc_cuvid",
-            "-fflags", "nobuffer",
-            "-flags", "low_delay",
-            "-i", stream_url,
-            "-f", "rawvideo",
-            "-pix_fmt", "bgr24",
-            "-s", f"{self._width}x{self._height}",
-            "-",
-        ]
 
     def run(self):
         thread = threading.Thread(target=self._run, daemon=True)
         thread.start()
 
     def _run(self):
+        tracking_pipe = None
+
         try:
+            decoder = detect_decoder(self._decoder)
+            logging.info(f"Decoder: {decoder}")
+
+            pass_fds = ()
+
+            if self._tracking is not None:
+                tracking_pipe = os.pipe()
+                pass_fds = (tracking_pipe[1],)
+
             self._ffmpeg_process = subprocess.Popen(
-                self._ffmpeg_command,
+                self._ffmpeg_command(decoder, tracking_pipe),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.DEVNULL,
+                pass_fds=pass_fds,
             )
 
-            frame_size = self._width * self._height * 3
             self._is_running.set()
 
-            while self._is_running.is_set():
-                buffer = self._ffmpeg_process.stdout.read(frame_size)
+            if tracking_pipe is not None:
+                os.close(tracking_pipe[1])
+                tracking_stream = os.fdopen(tracking_pipe[0], "rb")
+                tracking_pipe = None
 
-                if len(buffer) < frame_size:
-                    break
+                thread = threading.Thread(
+                    target=self._read_tracking_stream,
+                    args=(tracking_stream,),
+                    daemon=True,
+                )
 
-                frame = np.frombuffer(buffer, dtype=np.uint8)
-                frame = frame.reshape((self._height, self._width, 3))
+                thread.start()
 
-                with self._lock:
-                    self._current_frame = frame
+            self._display.read_from(self._ffmpeg_process.stdout, self._is_running)
         except Exception as error:
             logging.error(error)
         finally:
+            if tracking_pipe is not None:
+                os.close(tracking_pipe[0])
+                os.close(tracking_pipe[1])
+
             self.stop()
 
+    def _read_tracking_stream(self, stream):
+        try:
+            with stream:
+                self._tracking.read_from(stream, self._is_running)
+        except Exception as error:
+            logging.error(error)
+
+    def _ffmpeg_command(self, decoder, tracking_pipe):
+        command = [
+            "ffmpeg",
+            "-hide_banner",
+            *DECODER_BACKENDS[decoder],
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            "-i", self._stream_url,
+            *self._output_args(self._display, "pipe:1"),
+        ]
+
+        if tracking_pipe is not None:
+            command += self._output_args(self._tracking, f"pipe:{tracking_pipe[1]}")
+
+        return command
+
+    def _output_args(self, stream, output):
+        width, height = stream.get_resolution()
+
+        return [
+            "-map", "0:v",
+            "-f", "rawvideo",
+            "-pix_fmt", stream.get_pixel_format(),
+            "-s", f"{width}x{height}",
+            output,
+        ]
+
+    def get_display_stream(self):
+        return self._display
+
+    def get_tracking_stream(self):
+        """
+        Stream the tracker should consume: the reduced-resolution
+        grayscale stream if one is configured, the display stream otherwise.
+        """
+
+        if self._tracking is not None:
+            return self._tracking
+
+        return self._display
+
+    def lease(self):
+        return self._display.lease()
+
+    def wait_for_frame(self, after_id, timeout=None):
+        return self._display.wait_for_frame(after_id, timeout)
+
     def read(self):
-        with self._lock:
-            if self._current_frame is None:
-                return None
+        return self._display.read()
+
+    def get_frame_id(self):
+        return self._display.get_frame_id()
 
-            return self._current_frame.copy()
+    def get_dropped_frames(self):
+        return self._display.get_dropped_frames()
 
     def get_resolution(self):
         return self._width, self._height
@@ -20,9 +20,53 @@ CONTROLLER_PATH = "/dev/input/event15"
 
 VIDEO_STREAM_URL = "udp://127.0.0.1:9000?timeout=60000000"
 VIDEO_RESOLUTION = (1440, 960)
+# Frame buffers per stream: one for each consumer (tracker and preview),
+# the latest frame and the one being decoded, so at least 4.
+VIDEO_RING_SIZE = 4
+
+# Decoder backend: "auto" probes the hardware backends ("cuda", "vaapi",
+# "qsv") at startup and falls back to the "cpu" libavcodec decoder.
+VIDEO_DECODER = "auto"
+
+# Pixel format of the display stream: "bgr24" or "gray".
+VIDEO_PIXEL_FORMAT = "bgr24"
+
+# Resolution of an additional grayscale stream for the tracker,
+# or None to track on the display stream.
+VIDEO_TRACKING_RESOLUTION = None
+
+# Convert each tracking frame once, in the camera thread, into a shared
+# float32 luminance plane, so the tracker skips its own conversion.  This
+# converts every whole frame, even in standby, while the tracker with ROI
+# only converts the region around its particles; enable it when tracking
+# without ROI.
+VIDEO_PUBLISH_LUMA = False
 
 WINDOW_NAME = "UAV Guidance System"
 
+# Stage timings, end-to-end latency (frame capture to stick event) and
+# counters of the camera, tracker, autopilot and simulator.  Percentiles
+# cover the last METRICS_WINDOW samples of each stage.  The metrics are
+# written in the Prometheus text format to METRICS_PATH every
+# METRICS_INTERVAL seconds and/or served at http://localhost:METRICS_PORT/metrics
+# (None disables either output).  The server only listens on METRICS_HOST,
+# set it to "0.0.0.0" to serve the metrics to other machines.
+METRICS_ENABLED = False
+METRICS_WINDOW = 1000
+METRICS_PATH = "metrics.prom"
+METRICS_PORT = None
+METRICS_INTERVAL = 5.0
+METRICS_HOST = "127.0.0.1"
+
+# Flight recorder: an append-only log of tracker states, appearance model
+# updates and autopilot outputs, written to RECORDER_PATH and replayed with
+# replay.py.  With RECORDER_FRAMES, the tracking frames are also stored,
+# resized by RECORDER_FRAME_SCALE; replay needs them.
+RECORDER_ENABLED = False
+RECORDER_PATH = "flight.rec"
+RECORDER_FRAMES = True
+RECORDER_FRAME_SCALE = 0.5
+
 
 TRACKER_CONFIG = {
     # NPARTICLES. The number of particles used in the condensation
@@ -38,6 +82,33 @@ TRACKER_CONFIG = {
     # means remeber none of it.
     "FORGETTING": 0.95,
 
+    # ADAPTIVE_PARTICLES. Let the tracker pick the number of particles for
+    # every frame, starting from NPARTICLES, so that a frame takes at most
+    # FRAME_BUDGET seconds to process.  Within that budget, the count grows
+    # until TARGET_EFFECTIVE_PARTICLES particles carry most of the weight,
+    # and shrinks on easy frames.  It stays between MIN_PARTICLES and
+    # MAX_PARTICLES.
+    "ADAPTIVE_PARTICLES": False,
+    "FRAME_BUDGET": 0.010,
+    "MIN_PARTICLES": 100,
+    "MAX_PARTICLES": 2000,
+    "TARGET_EFFECTIVE_PARTICLES": 4,
+
+    # SEED. Seed of the random numbers drawn by the particle filter.  With
+    # the same seed and frames, two runs produce the same track; None draws
+    # a fresh seed from the operating system on every start.
+    "SEED": None,
+
+    # RESAMPLING. The strategy used to resample particles between frames:
+    # "multinomial", "systematic", "stratified" or "residual".  Systematic
+    # and stratified resampling add less noise than multinomial sampling.
+    "RESAMPLING": "systematic",
+
+    # RESAMPLE_THRESHOLD. Particles are only resampled when the effective
+    # sample size drops below this fraction of NPARTICLES; otherwise their
+    # weights are carried over to the next frame.  1 means always resample.
+    "RESAMPLE_THRESHOLD": 0.5,
+
     # BATCH_SIZE. How often to update the eigenbasis. We've used this
     # value (update every 5th frame) fairly consistently, so it most
     # likely won't need to be changed.  A smaller batchsize means more
@@ -45,17 +116,59 @@ TRACKER_CONFIG = {
     # but also a little more prone to drift, and require more computation.
     "BATCH_SIZE": 5,
 
+    # ROI. Convert only the part of the frame covered by the particle cloud
+    # to grayscale instead of the whole frame.  ROI_MARGIN is the number of
+    # pixels added around the particles' patches.
+    "ROI": True,
+    "ROI_MARGIN": 8,
+
     # TEMPLATE_SIZE. The resolution at which the tracking window is
     # sampled, 32-by-32 pixels by default.  If your initial
     # object window is very large you may need to increase this.
     "TEMPLATE_SIZE": 32,
 
+    # SKLM. How the eigenbasis is updated: "incremental" uses preallocated
+    # buffers and truncates to MAX_BASIS inside the update, "reference"
+    # runs the original sklm for numerical comparison.
+    "SKLM": "incremental",
+
+    # ASYNC_MODEL_UPDATE. Run the eigenbasis update on a background worker
+    # while the particle filter keeps using the previous basis, so frames
+    # that complete a batch are not delayed by it. MAX_MODEL_STALENESS is
+    # the most frames scored with the previous basis, after which the
+    # tracker waits for a pending update.
+    # With a SEED or the flight recorder, updates are always applied after
+    # that many frames, so that runs don't depend on thread timing.
+    "ASYNC_MODEL_UPDATE": True,
+    "MAX_MODEL_STALENESS": 2,
+
+    # MAX_TARGETS. The number of targets that can be locked at once.  With
+    # more than one, every return to tracking mode locks another target at
+    # the reticle, and TARGET_SELECTION picks the one the autopilot follows:
+    # "first" (earliest locked), "largest" or "nearest" (to the image center).
+    "MAX_TARGETS": 1,
+    "TARGET_SELECTION": "first",
+
     # MAX_BASIS. The number of basis vectors to keep in the learned
     # apperance model.
     "MAX_BASIS": 16,
 
-    # RESIZE_RATE. Of input frames.
+    # RESIZE_RATE. The downscaling factor between two levels of the image
+    # pyramid.  PYRAMID_LEVELS is the number of levels; particles are
+    # evaluated at the coarsest level where the estimated target still
+    # covers TEMPLATE_SIZE pixels, so large or close targets are tracked
+    # on a fraction of the pixels.  1 level disables the pyramid.
     "RESIZE_RATE": 0.8,
+    "PYRAMID_LEVELS": 6,
+
+    # MOTION_MODEL. How the particles are moved before the random walk of
+    # AFFSIG: "none" keeps them in place, "velocity" shifts them by the
+    # target's estimated velocity and "acceleration" also extrapolates its
+    # change.  The estimates come from the tracked positions, smoothed with
+    # MOTION_SMOOTHING as the weight of the previous estimate.  Fast targets
+    # then stay inside the particle cloud with a smaller AFFSIG.
+    "MOTION_MODEL": "velocity",
+    "MOTION_SMOOTHING": 0.5,
 
     # AFFSIG. These are the standard deviations of the dynamics distribution,
     # that is how much we expect the target object might move from one frame to the next.
@@ -68,3 +181,67 @@ TRACKER_CONFIG = {
     #    AFFSIG(5) = skew angle (radians)
     "AFFSIG": np.array([10, 10, 0.05, 0.002], dtype=np.float32),
 }
+
+
+AUTOPILOT_CONFIG = {
+    # CONTROL_RATE. How many times per second the stick positions are
+    # updated, independently of the rate at which targets are tracked.
+    "CONTROL_RATE": 50,
+
+    # MAX_PREDICTION. The target is extrapolated from the capture time of
+    # its frame to the present, for at most this many seconds.
+    "MAX_PREDICTION": 0.15,
+
+    # VELOCITY_SMOOTHING. Weight of the previous estimate when updating the
+    # target's image-plane velocity from a new tracked position.
+    "VELOCITY_SMOOTHING": 0.5,
+
+    # TARGET_TIMEOUT. Stop steering when the latest target was captured
+    # more than this many seconds ago, and return the sticks to their
+    # BIAS positions.
+    "TARGET_TIMEOUT": 0.5,
+
+    # KP, KI, KD. PID gains of the pitch, roll, yaw and throttle axes, in
+    # full stick deflections per unit of normalized error (the target's
+    # offset from the image center, relative to half the image size).
+    "KP": [1.0, 1.0, 1.0, 1.0],
+    "KI": [0.2, 0.2, 0.2, 0.2],
+    "KD": [0.05, 0.05, 0.05, 0.05],
+
+    # BIAS. Constant stick deflection added to each axis, in full stick
+    # deflections.
+    "BIAS": [0.0, 0.0, 0.0, -0.05],
+
+    # INTEGRAL_LIMIT. Bound of the integrated error, so the integral term
+    # can't wind up while the target is far off center.
+    "INTEGRAL_LIMIT": 0.5,
+
+    # DERIVATIVE_FILTER. Time constant, in seconds, of the low-pass filter
+    # applied to the error derivative against tracking jitter.
+    "DERIVATIVE_FILTER": 0.05,
+
+    # RATE_LIMIT. Largest change of a stick position per second, in full
+    # stick deflections.
+    "RATE_LIMIT": 4.0,
+}
+
+
+DISPLAY_CONFIG = {
+    # ENABLED. Show the video with the overlay in a preview window; False
+    # runs headless, the controller still passes through the simulator.
+    "ENABLED": True,
+
+    # SCALE. Size of the preview relative to VIDEO_RESOLUTION.  A smaller
+    # preview is cheaper to copy, draw and show.
+    "SCALE": 1.0,
+
+    # MAX_FPS. Most frames shown per second; newer frames arriving in
+    # between are skipped.  60 shows every frame of a 60 fps stream, lower
+    # it to spare CPU on a loaded machine.
+    "MAX_FPS": 60,
+
+    # NICENESS. Added to the scheduling niceness of the display thread
+    # (Linux only), so that on a loaded machine it yields the CPU to the
+    # camera, tracker and autopilot.
+    "NICENESS": 10,
+}
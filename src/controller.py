@@ -1,3 +1,4 @@
+import threading
 import libevdev
 
 
@@ -9,6 +10,9 @@ class VirtualController:
         self._configure_device(device)
         self._uinput = device.create_uinput_device()
 
+        self._axis_values = {}
+        self._lock = threading.Lock()
+
     def _configure_device(self, device):
         def create_absinfo(value):
             return libevdev.InputAbsInfo(0, 2047, 7, 127, 0, value)
@@ -22,5 +26,29 @@ class VirtualController:
         device.enable(libevdev.EV_KEY.BTN_TL)
 
     def send_event(self, event):
-        syn_report = libevdev.InputEvent(libevdev.EV_SYN.SYN_REPORT, 0)
-        self._uinput.send_events([event, syn_report])
+        self.send_events([event])
+
+    def send_events(self, events):
+        """
+        Emit several events followed by a single SYN_REPORT, so the
+        receiver sees them as one atomic update. Axis events whose value
+        did not change since the last report are skipped.
+        """
+
+        with self._lock:
+            changed_events = []
+
+            for event in events:
+                if event.matches(libevdev.EV_ABS):
+                    if self._axis_values.get(event.code.value) == event.value:
+                        continue
+
+                    self._axis_values[event.code.value] = event.value
+
+                changed_events.append(event)
+
+            if not changed_events:
+                return
+
+            syn_report = libevdev.InputEvent(libevdev.EV_SYN.SYN_REPORT, 0)
+            self._uinput.send_events([*changed_events, syn_report])
@@ -2,26 +2,80 @@ import libevdev
 import logging
 from camera import VirtualCamera
 from simulator import Simulator
-from tracker import IncrementalTracker
+from tracker import IncrementalTracker, MultiTargetTracker
 from autopilot import Autopilot
+from profiler import Profiler, MetricsExporter
+from recorder import FlightRecorder
 from config import (
     SystemState,
     CONTROLLER_NAME,
     CONTROLLER_PATH,
     VIDEO_STREAM_URL,
     VIDEO_RESOLUTION,
+    VIDEO_RING_SIZE,
+    VIDEO_DECODER,
+    VIDEO_PIXEL_FORMAT,
+    VIDEO_TRACKING_RESOLUTION,
+    VIDEO_PUBLISH_LUMA,
     WINDOW_NAME,
     TRACKER_CONFIG,
+    AUTOPILOT_CONFIG,
+    DISPLAY_CONFIG,
+    METRICS_ENABLED,
+    METRICS_WINDOW,
+    METRICS_PATH,
+    METRICS_PORT,
+    METRICS_INTERVAL,
+    METRICS_HOST,
+    RECORDER_ENABLED,
+    RECORDER_PATH,
+    RECORDER_FRAMES,
+    RECORDER_FRAME_SCALE,
 )
 
 
 def main():
-    camera = VirtualCamera(VIDEO_STREAM_URL, VIDEO_RESOLUTION)
-    simulator = Simulator(camera, CONTROLLER_NAME, WINDOW_NAME)
-    autopilot = Autopilot(simulator, VIDEO_RESOLUTION)
-    tracker = IncrementalTracker(camera, simulator, autopilot, TRACKER_CONFIG)
+    profiler = Profiler(METRICS_ENABLED, METRICS_WINDOW)
+    exporter = MetricsExporter(profiler, METRICS_PATH, METRICS_PORT, METRICS_INTERVAL, METRICS_HOST)
+
+    recorder = None
+
+    if RECORDER_ENABLED:
+        recorder = FlightRecorder(RECORDER_PATH, RECORDER_FRAMES, RECORDER_FRAME_SCALE)
+
+    camera = VirtualCamera(
+        VIDEO_STREAM_URL,
+        VIDEO_RESOLUTION,
+        VIDEO_RING_SIZE,
+        VIDEO_DECODER,
+        VIDEO_PIXEL_FORMAT,
+        VIDEO_TRACKING_RESOLUTION,
+        VIDEO_PUBLISH_LUMA,
+        profiler,
+    )
+
+    simulator = Simulator(camera, CONTROLLER_NAME, WINDOW_NAME, DISPLAY_CONFIG, profiler)
+    autopilot = Autopilot(simulator, VIDEO_RESOLUTION, AUTOPILOT_CONFIG, profiler, recorder)
+
+    if TRACKER_CONFIG["MAX_TARGETS"] > 1:
+        tracker_class = MultiTargetTracker
+    else:
+        tracker_class = IncrementalTracker
+
+    tracker = tracker_class(
+        camera.get_tracking_stream(),
+        simulator,
+        autopilot,
+        TRACKER_CONFIG,
+        profiler,
+        recorder,
+    )
 
     try:
+        if recorder is not None:
+            recorder.run()
+
+        exporter.run()
         camera.run()
         simulator.run()
         tracker.run()
@@ -46,6 +100,10 @@ def main():
         tracker.stop()
         simulator.stop()
         camera.stop()
+        exporter.stop()
+
+        if recorder is not None:
+            recorder.stop()
 
 
 def process_event(event, simulator, tracker, autopilot):
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class PIDController:
+    """
+    Discrete PID controllers for several axes, updated together at a
+    fixed time step.
+
+    Every parameter is either a scalar shared by all axes or an array with
+    one value per axis; with scalars only, the errors set the number of
+    axes. The output is `offset + P + I + D`, limited to
+    change by at most `rate_limit` per second, starting from `offset`
+    after a reset, and saturated to [`output_min`, `output_max`].
+
+    The integral term is clamped to `integral_limit` and stops growing
+    while the output is saturated in the direction of the error, so it
+    does not wind up. The derivative of the error is smoothed by a
+    first-order low-pass filter with time constant `derivative_filter`.
+    """
+
+    def __init__(
+        self,
+        kp,
+        ki,
+        kd,
+        dt,
+        offset=0.0,
+        output_min=-np.inf,
+        output_max=np.inf,
+        integral_limit=np.inf,
+        derivative_filter=0.0,
+        rate_limit=np.inf,
+    ):
+        self._kp = np.asarray(kp, dtype=np.float64)
+        self._ki = np.asarray(ki, dtype=np.float64)
+        self._kd = np.asarray(kd, dtype=np.float64)
+        self._dt = dt
+
+        self._offset = np.asarray(offset, dtype=np.float64)
+        self._output_min = np.asarray(output_min, dtype=np.float64)
+        self._output_max = np.asarray(output_max, dtype=np.float64)
+        self._integral_limit = np.asarray(integral_limit, dtype=np.float64)
+        self._max_step = np.asarray(rate_limit, dtype=np.float64) * dt
+
+        self._derivative_alpha = derivative_filter / (derivative_filter + dt)
+
+        # With scalar settings only, the number of axes is taken
+        # from the first error.
+        self._allocate(np.broadcast(self._kp, self._ki, self._kd, self._offset).shape)
+
+    def _allocate(self, shape):
+        self._integral = np.zeros(shape)
+        self._derivative = np.zeros(shape)
+        self._previous_error = np.zeros(shape)
+        self._output = np.zeros(shape)
+        self._is_reset = True
+
+        self._term = np.zeros(shape)
+        self._candidate = np.zeros(shape)
+
+    def update(self, error):
+        """
+        Advance all axes by one time step.
+
+        Parameters
+        ----------
+        error : ndarray
+            Control error of each axis
+
+        Returns
+        -------
+        ndarray
+            Output of each axis; overwritten by the next update
+        """
+
+        if np.shape(error) != self._integral.shape:
+            self._allocate(np.broadcast_shapes(self._integral.shape, np.shape(error)))
+
+        if self._is_reset:
+            # No derivative kick on the first step, whose output
+            # moves from the offset within the rate limit.
+            np.copyto(self._previous_error, error)
+            self._derivative.fill(0.0)
+            np.clip(self._offset, self._output_min, self._output_max, out=self._output)
+
+        # Derivative, low-pass filtered.
+        np.subtract(error, self._previous_error, out=self._term)
+        self._term /= self._dt
+        self._derivative *= self._derivative_alpha
+        self._derivative += (1.0 - self._derivative_alpha) * self._term
+        np.copyto(self._previous_error, error)
+
+        # Integral, clamped, integrated only if it would not push a
+        # saturated output further into saturation.
+        np.multiply(error, self._dt, out=self._term)
+        self._term += self._integral
+        np.clip(self._term, -self._integral_limit, self._integral_limit, out=self._term)
+
+        is_high = (self._output >= self._output_max) & (self._ki * error > 0)
+        is_low = (self._output <= self._output_min) & (self._ki * error < 0)
+        np.copyto(self._integral, self._term, where=~(is_high | is_low))
+
+        np.multiply(self._kp, error, out=self._candidate)
+        self._candidate += self._offset
+        self._candidate += self._ki * self._integral
+        self._candidate += self._kd * self._derivative
+
+        np.clip(
+            self._candidate,
+            self._output - self._max_step,
+            self._output + self._max_step,
+            out=self._candidate,
+        )
+
+        np.clip(self._candidate, self._output_min, self._output_max, out=self._output)
+        self._is_reset = False
+
+        return self._output
+
+    def reset(self):
+        self._integral.fill(0.0)
+        self._derivative.fill(0.0)
+        self._previous_error.fill(0.0)
+        self._is_reset = True
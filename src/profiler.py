@@ -0,0 +1,235 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Profiler:
+    """
+    Collects monotonic-clock durations of named pipeline stages,
+    counters and gauges, shared by all threads.
+
+    Durations are kept in a rolling window of the most recent `window`
+    samples per stage, so percentiles follow the current behavior.
+    When disabled, `span` returns a shared no-op context manager and the
+    other methods return immediately, so instrumented code pays almost
+    nothing.
+    """
+
+    def __init__(self, enabled=False, window=1000):
+        self._enabled = enabled
+        self._window = window
+
+        self._samples = defaultdict(self._create_window)
+        self._counts = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+        self._lock = threading.Lock()
+        self._null_span = nullcontext()
+
+    def _create_window(self):
+        return deque(maxlen=self._window)
+
+    def is_enabled(self):
+        return self._enabled
+
+    def span(self, name):
+        if not self._enabled:
+            return self._null_span
+
+        return _Span(self, name)
+
+    def record(self, name, duration):
+        if not self._enabled:
+            return
+
+        with self._lock:
+            self._samples[name].append(duration)
+            self._counts[name] += 1
+
+    def increment(self, name, value=1):
+        if not self._enabled:
+            return
+
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name, value):
+        if not self._enabled:
+            return
+
+        with self._lock:
+            self._gauges[name] = value
+
+    def summary(self):
+        with self._lock:
+            samples = {name: np.asarray(window) for name, window in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+
+        for name, durations in samples.items():
+            if durations.size == 0:
+                continue
+
+            summary[name] = {
+                "count": counts[name],
+                "mean": float(np.mean(durations)),
+                "p50": float(np.percentile(durations, 50)),
+                "p95": float(np.percentile(durations, 95)),
+                "p99": float(np.percentile(durations, 99)),
+                "max": float(np.max(durations)),
+            }
+
+        return summary
+
+    def get_counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def get_gauges(self):
+        with self._lock:
+            return dict(self._gauges)
+
+    def to_prometheus(self, prefix="uav"):
+        """
+        Render the current metrics in the Prometheus text exposition format.
+        """
+
+        lines = [
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+
+        for name, stats in sorted(self.summary().items()):
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(f'{prefix}_stage_seconds{{stage="{name}",quantile="{quantile}"}} {stats[key]:.9f}')
+
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+
+        for name, value in sorted(self.get_counters().items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value:g}")
+
+        for name, value in sorted(self.get_gauges().items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._profiler.record(self._name, time.perf_counter() - self._start)
+
+
+class MetricsExporter:
+    """
+    Publishes the metrics of a profiler in the Prometheus text format,
+    by rewriting a file every `interval` seconds and/or by serving them
+    over HTTP at `/metrics` on `port` of the `host` interface, only
+    reachable from this machine by default.
+    """
+
+    def __init__(self, profiler, path=None, port=None, interval=5.0, host="127.0.0.1"):
+        self._profiler = profiler
+        self._path = path
+        self._port = port
+        self._interval = interval
+        self._host = host
+
+        self._server = None
+        self._is_running = threading.Event()
+
+    def run(self):
+        if not self._profiler.is_enabled():
+            return
+
+        self._is_running.set()
+
+        if self._port is not None:
+            self._server = ThreadingHTTPServer((self._host, self._port), self._create_handler())
+
+            thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            thread.start()
+
+        if self._path is not None:
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+
+    def _run(self):
+        try:
+            while self._is_running.is_set():
+                self.write()
+                time.sleep(self._interval)
+        except Exception as error:
+            logging.error(error)
+
+    def write(self):
+        """
+        Replace the metrics file atomically, so readers never
+        see a partially written file.
+        """
+
+        temporary_path = f"{self._path}.tmp"
+
+        with open(temporary_path, "w") as fd:
+            fd.write(self._profiler.to_prometheus())
+
+        os.replace(temporary_path, self._path)
+
+    def _create_handler(self):
+        profiler = self._profiler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = profiler.to_prometheus().encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def stop(self):
+        if not self._is_running.is_set():
+            return
+
+        self._is_running.clear()
+
+        if self._path is not None:
+            self.write()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,347 @@
+import os
+import cv2
+import json
+import mmap
+import struct
+import logging
+import threading
+import numpy as np
+from collections import deque
+
+
+MAGIC = b"UAVREC02"
+
+RECORD_INIT = 1
+RECORD_STATE = 2
+RECORD_BASIS = 3
+RECORD_CONTROL = 4
+RECORD_FRAME = 5
+
+# Type and payload length of every record.
+_RECORD_HEADER = struct.Struct("<BxxxI")
+
+_INIT = struct.Struct("<QdII")
+_STATE = struct.Struct("<QdffI")
+_BASIS = struct.Struct("<QII")
+_CONTROL = struct.Struct("<dI")
+_FRAME = struct.Struct("<QdIIIf")
+
+
+class FlightRecorder:
+    """
+    Append-only binary log of an engagement: tracker initialization,
+    per-frame estimates and weight summaries, appearance model snapshots,
+    autopilot axis values and, optionally, downscaled frames.
+
+    Records are packed by the calling thread into small byte strings and
+    queued; a writer thread copies them into a memory-mapped file that is
+    grown in chunks, so recording never waits for the disk.  Frames are
+    only copied into one of `frame_buffers` preallocated buffers by the
+    caller, and resized and packed by the writer thread.  At most
+    `max_queue_size` bytes are queued; while the disk lags behind, newer
+    records are dropped and counted instead.
+    """
+
+    def __init__(
+        self,
+        path,
+        record_frames=False,
+        frame_scale=0.5,
+        chunk_size=64 << 20,
+        max_queue_size=256 << 20,
+        frame_buffers=4,
+    ):
+        self._path = path
+        self._record_frames = record_frames
+        self._frame_scale = frame_scale
+        self._chunk_size = chunk_size
+        self._max_queue_size = max_queue_size
+
+        self._frame_buffers = frame_buffers
+        self._free_frames = []
+        self._allocated_frames = 0
+
+        self._queue = deque()
+        self._queue_size = 0
+        self._dropped = 0
+        self._condition = threading.Condition()
+        self._is_running = threading.Event()
+        self._thread = None
+
+        self._fd = None
+        self._mmap = None
+        self._size = 0
+        self._position = 0
+
+    def run(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._map(self._chunk_size)
+
+        self._write(MAGIC)
+        self._is_running.set()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._queue or not self._is_running.is_set())
+
+                    if not self._queue:
+                        break
+
+                    record = self._queue.popleft()
+                    self._queue_size -= _queued_size(record)
+
+                if isinstance(record, bytes):
+                    self._write(record)
+                else:
+                    self._write_frame(*record)
+        except Exception as error:
+            logging.error(error)
+        finally:
+            self._close()
+
+    def _map(self, size):
+        if self._mmap is not None:
+            self._mmap.close()
+
+        os.ftruncate(self._fd, size)
+
+        self._mmap = mmap.mmap(self._fd, size)
+        self._size = size
+
+    def _write(self, data):
+        end = self._position + len(data)
+
+        if end > self._size:
+            self._map(max(end, self._size + self._chunk_size))
+
+        self._mmap[self._position:end] = data
+        self._position = end
+
+    def _write_frame(self, frame_id, timestamp, buffer):
+        image = buffer
+
+        if self._frame_scale != 1.0:
+            height, width = image.shape[:2]
+            size = (max(1, round(width * self._frame_scale)), max(1, round(height * self._frame_scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+        with self._condition:
+            self._free_frames.append(buffer)
+
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+
+        header = _FRAME.pack(frame_id, timestamp, height, width, channels, self._frame_scale)
+
+        self._write(_RECORD_HEADER.pack(RECORD_FRAME, len(header) + image.nbytes))
+        self._write(header)
+        self._write(memoryview(np.ascontiguousarray(image)).cast("B"))
+
+    def _close(self):
+        if self._mmap is None:
+            return
+
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+
+        # Drop the unused part of the last chunk.
+        os.ftruncate(self._fd, self._position)
+        os.close(self._fd)
+        self._fd = None
+
+    def _append(self, record_type, *parts):
+        if not self._is_running.is_set():
+            return
+
+        length = sum(len(part) for part in parts)
+        record = b"".join((_RECORD_HEADER.pack(record_type, length), *parts))
+
+        with self._condition:
+            if self._queue_size + len(record) > self._max_queue_size:
+                self._dropped += 1
+                return
+
+            self._queue.append(record)
+            self._queue_size += len(record)
+            self._condition.notify()
+
+    def get_dropped(self):
+        with self._condition:
+            return self._dropped
+
+    def record_init(self, frame_id, timestamp, params, rng_state=None):
+        params = np.asarray(params, dtype=np.float32)
+        rng_state = json.dumps(rng_state).encode()
+
+        self._append(
+            RECORD_INIT,
+            _INIT.pack(frame_id, timestamp, params.size, len(rng_state)),
+            params.tobytes(),
+            rng_state,
+        )
+
+    def record_state(self, frame_id, timestamp, est, conf):
+        est = np.asarray(est, dtype=np.float32)
+        max_conf = float(np.max(conf))
+        ess = float(1.0 / np.sum(np.square(conf, dtype=np.float64)))
+
+        self._append(RECORD_STATE, _STATE.pack(frame_id, timestamp, max_conf, ess, est.size), est.tobytes())
+
+    def record_basis(self, frame_id, mean, basis, eigval):
+        rows, cols = basis.shape
+
+        self._append(
+            RECORD_BASIS,
+            _BASIS.pack(frame_id, rows, cols),
+            np.asarray(mean, dtype=np.float32).tobytes(),
+            np.ascontiguousarray(basis, dtype=np.float32).tobytes(),
+            np.asarray(eigval, dtype=np.float32).tobytes(),
+        )
+
+    def record_control(self, timestamp, values):
+        values = np.asarray(values, dtype=np.int32)
+        self._append(RECORD_CONTROL, _CONTROL.pack(timestamp, values.size), values.tobytes())
+
+    def record_frame(self, frame_id, timestamp, image):
+        if not self._record_frames or not self._is_running.is_set():
+            return
+
+        with self._condition:
+            buffer = self._acquire_frame_buffer(image)
+
+            if buffer is None or self._queue_size + buffer.nbytes > self._max_queue_size:
+                if buffer is not None:
+                    self._free_frames.append(buffer)
+
+                self._dropped += 1
+                return
+
+        np.copyto(buffer, image)
+
+        with self._condition:
+            self._queue.append((frame_id, timestamp, buffer))
+            self._queue_size += buffer.nbytes
+            self._condition.notify()
+
+    def _acquire_frame_buffer(self, image):
+        while self._free_frames:
+            buffer = self._free_frames.pop()
+
+            if buffer.shape == image.shape and buffer.dtype == image.dtype:
+                return buffer
+
+            # The frame size changed, this buffer is replaced.
+            self._allocated_frames -= 1
+
+        if self._allocated_frames >= self._frame_buffers:
+            return None
+
+        self._allocated_frames += 1
+        return np.empty_like(image)
+
+    def stop(self):
+        if not self._is_running.is_set():
+            return
+
+        with self._condition:
+            self._is_running.clear()
+            self._condition.notify()
+
+        # Let the writer drain the queue and trim the file.
+        self._thread.join()
+        self._thread = None
+
+        if self._dropped:
+            logging.warning(f"Flight recorder dropped {self._dropped} records")
+
+
+def _queued_size(record):
+    if isinstance(record, bytes):
+        return len(record)
+
+    return record[2].nbytes
+
+
+def read_flight(path):
+    """
+    Iterate over the records of a flight log.
+
+    Yields
+    ------
+    tuple
+        Record type and a dict of its fields
+    """
+
+    with open(path, "rb") as fd:
+        data = fd.read()
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"Not a flight log: {path}")
+
+    position = len(MAGIC)
+
+    while position + _RECORD_HEADER.size <= len(data):
+        record_type, length = _RECORD_HEADER.unpack_from(data, position)
+        position += _RECORD_HEADER.size
+
+        if position + length > len(data):
+            # Truncated by a crash while writing.
+            break
+
+        payload = memoryview(data)[position:position + length]
+        position += length
+
+        yield record_type, _parse_record(record_type, payload)
+
+
+def _parse_record(record_type, payload):
+    if record_type == RECORD_INIT:
+        frame_id, timestamp, size, state_length = _INIT.unpack_from(payload)
+        params = np.frombuffer(payload, np.float32, size, _INIT.size)
+
+        start = _INIT.size + params.nbytes
+        rng_state = json.loads(bytes(payload[start:start + state_length]))
+
+        return {"frame_id": frame_id, "timestamp": timestamp, "params": params, "rng_state": rng_state}
+
+    if record_type == RECORD_STATE:
+        frame_id, timestamp, max_conf, ess, size = _STATE.unpack_from(payload)
+        est = np.frombuffer(payload, np.float32, size, _STATE.size)
+
+        return {"frame_id": frame_id, "timestamp": timestamp, "est": est, "max_conf": max_conf, "ess": ess}
+
+    if record_type == RECORD_BASIS:
+        frame_id, rows, cols = _BASIS.unpack_from(payload)
+        values = np.frombuffer(payload, np.float32, rows + rows * cols + cols, _BASIS.size)
+
+        return {
+            "frame_id": frame_id,
+            "mean": values[:rows],
+            "basis": values[rows:rows + rows * cols].reshape(rows, cols),
+            "eigval": values[rows + rows * cols:],
+        }
+
+    if record_type == RECORD_CONTROL:
+        timestamp, size = _CONTROL.unpack_from(payload)
+        values = np.frombuffer(payload, np.int32, size, _CONTROL.size)
+
+        return {"timestamp": timestamp, "values": values}
+
+    if record_type == RECORD_FRAME:
+        frame_id, timestamp, height, width, channels, scale = _FRAME.unpack_from(payload)
+        image = np.frombuffer(payload, np.uint8, height * width * channels, _FRAME.size)
+
+        if channels == 1:
+            image = image.reshape(height, width)
+        else:
+            image = image.reshape(height, width, channels)
+
+        return {"frame_id": frame_id, "timestamp": timestamp, "image": image, "scale": scale}
+
+    return {}
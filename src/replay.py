@@ -0,0 +1,134 @@
+import argparse
+import numpy as np
+from camera import Frame
+from profiler import Profiler
+from tracker import IncrementalTracker, TargetSink
+from config import TRACKER_CONFIG
+from recorder import RECORD_INIT, RECORD_STATE, RECORD_FRAME, read_flight
+
+
+class RecordedFlight:
+    """
+    Frames of a flight log, replayed with their original frame ids
+    and timestamps, along with the recorded tracker states.
+    """
+
+    def __init__(self, path):
+        self.init = None
+        self.states = {}
+        self._frames = []
+
+        for record_type, record in read_flight(path):
+            if record_type == RECORD_INIT and self.init is None:
+                self.init = record
+            elif record_type == RECORD_STATE:
+                self.states[record["frame_id"]] = record
+            elif record_type == RECORD_FRAME:
+                self._frames.append(record)
+
+        if self.init is None:
+            raise ValueError(f"No tracker initialization in {path}")
+
+        if not self._frames:
+            raise ValueError(f"No frames in {path}, record with RECORDER_FRAMES")
+
+        # Frames recorded before the tracker was initialized are skipped.
+        self._index = next(
+            index for index, record in enumerate(self._frames)
+            if record["frame_id"] == self.init["frame_id"]
+        )
+
+        self.scale = self._frames[self._index]["scale"]
+
+    def get_resolution(self):
+        height, width = self._frames[self._index]["image"].shape[:2]
+        return width, height
+
+    def get_scale(self):
+        return 1.0, 1.0
+
+    def advance(self):
+        if self._index + 1 >= len(self._frames):
+            return False
+
+        self._index += 1
+        return True
+
+    def lease(self):
+        record = self._frames[self._index]
+        return Frame(None, None, record["image"], record["frame_id"], record["timestamp"])
+
+
+def replay(flight, config, seed=None):
+    """
+    Run the tracker again over the frames of a flight, from its recorded
+    initial state and random number generator state, or with `seed`
+    instead of the recorded generator state.
+
+    Returns
+    -------
+    list
+        Frame id, and distance in pixels of the original frame between the
+        replayed and the recorded estimate, of every frame
+    """
+
+    # A seeded tracker applies model updates at the same frames as the
+    # recorded run; the seed is replaced by the recorded state below.
+    config = dict(config)
+    config["SEED"] = 0 if seed is None else seed
+
+    sink = TargetSink()
+    tracker = IncrementalTracker(flight, sink, sink, config, Profiler())
+
+    if seed is None:
+        tracker.set_rng_state(flight.init["rng_state"])
+
+    # The tracker sees the downscaled frames.
+    initial_params = flight.init["params"].copy()
+    initial_params[:3] *= flight.scale
+
+    tracker.init(initial_params)
+
+    divergence = []
+
+    while flight.advance():
+        frame = flight.lease()
+        est = tracker.process(frame)
+
+        state = flight.states.get(frame.id)
+
+        if state is None:
+            continue
+
+        error = np.hypot(*(est[:2] / flight.scale - state["est"][:2]))
+        divergence.append((frame.id, float(error)))
+
+    tracker.stop()
+
+    return divergence
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a flight log through the tracker")
+    parser.add_argument("path", help="flight log written by the flight recorder")
+    parser.add_argument("--seed", type=int, help="seed instead of the recorded generator state")
+    args = parser.parse_args()
+
+    flight = RecordedFlight(args.path)
+    divergence = replay(flight, TRACKER_CONFIG, args.seed)
+
+    if not divergence:
+        print("no recorded states to compare")
+        return
+
+    errors = np.array([error for _, error in divergence])
+    worst_frame, worst_error = max(divergence, key=lambda item: item[1])
+
+    print(
+        f"frames={len(divergence)} divergence_mean={np.mean(errors):.2f}px "
+        f"divergence_max={worst_error:.2f}px at frame {worst_frame}"
+    )
+
+
+if __name__ == "__main__":
+    main()
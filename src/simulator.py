@@ -1,124 +1,260 @@
+import os
+import sys
 import cv2
 import time
 import logging
 import threading
+import numpy as np
 from controller import VirtualController
+from profiler import Profiler
 
 
 class Simulator:
-    def __init__(self, camera, controller_name, window_name):
+    """
+    Forwards controller events to the simulator and shows its video with
+    the reticle and tracked targets in a preview window.
+
+    The preview is only redrawn for new frames, at most `MAX_FPS` times
+    per second and at `SCALE` of the video resolution. The overlay is
+    rebuilt only when the reticle or targets move by a preview pixel,
+    and drawn with one polyline call per color.
+    """
+
+    def __init__(self, camera, controller_name, window_name, config, profiler=None):
         self._camera = camera
+        self._profiler = profiler or Profiler()
         self._window_name = window_name
         self._frame_time = 1 / 60
+        self._frame_id = 0
+
+        self._is_enabled = config["ENABLED"]
+        self._scale = config["SCALE"]
+        self._render_interval = 1.0 / config["MAX_FPS"]
+        self._niceness = config["NICENESS"]
+        self._next_render = 0.0
 
         self._controller = VirtualController(controller_name)
         self._lock = threading.Lock()
         self._is_running = threading.Event()
 
-        self._reticle = None
-        self._target = None
+        self._targets = []
+        self._display_frame = None
+        self._gray_frame = None
+        self._overlay_shapes = None
+        self._overlay_key = None
 
         self._overlay = {
             "crosshair_size": 4,
             "color": (255, 255, 255),
+            "secondary_color": (128, 128, 128),
+            "font_scale": 0.5,
             "thickness": 2,
         }
 
+        width, height = camera.get_resolution()
+
+        self._reticle = {
+            "x": width // 2,
+            "y": height // 2,
+            "size": 40,
+        }
+
     def run(self):
+        if not self._is_enabled:
+            return
+
         thread = threading.Thread(target=self._run, daemon=True)
         thread.start()
 
     def _run(self):
         try:
+            self._lower_priority()
             self._create_window()
             self._is_running.set()
 
             while self._is_running.is_set():
-                start_time = time.time()
+                # Waiting for a key also lets the window handle its events,
+                # until the next frame may be shown.
+                delay = max(1, int((self._next_render - time.monotonic()) * 1000))
+
+                with self._profiler.span("wait_key"):
+                    key = cv2.waitKey(delay)
 
-                if cv2.waitKey(1) == ord("q"):
+                if key == ord("q"):
                     break
 
-                frame = self._camera.read()
+                frame = self._camera.wait_for_frame(self._frame_id, self._frame_time)
 
                 if frame is None:
                     continue
 
-                self._draw_overlay(frame)
-                cv2.imshow(self._window_name, frame)
+                self._next_render = time.monotonic() + self._render_interval
 
-                duration = time.time() - start_time
-                sleep_time = self._frame_time - duration
+                with self._profiler.span("render"):
+                    with frame:
+                        self._frame_id = frame.id
+                        self._render_frame(frame.image)
 
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+                    self._draw_overlay(self._display_frame)
+
+                with self._profiler.span("display"):
+                    cv2.imshow(self._window_name, self._display_frame)
         except Exception as error:
             logging.error(error)
         finally:
             self.stop()
 
+    def _lower_priority(self):
+        # Linux schedules threads individually, elsewhere this would
+        # lower the priority of the whole process.
+        if self._niceness <= 0 or not sys.platform.startswith("linux"):
+            return
+
+        thread_id = threading.get_native_id()
+
+        try:
+            niceness = os.getpriority(os.PRIO_PROCESS, thread_id) + self._niceness
+            os.setpriority(os.PRIO_PROCESS, thread_id, niceness)
+        except OSError as error:
+            logging.warning(f"Could not lower the display priority: {error}")
+
     def _create_window(self):
         width, height = self._camera.get_resolution()
+        width = max(1, round(width * self._scale))
+        height = max(1, round(height * self._scale))
 
         cv2.namedWindow(self._window_name, cv2.WINDOW_GUI_NORMAL)
         cv2.resizeWindow(self._window_name, width, height)
 
-        self._reticle = {
-            "x": width // 2,
-            "y": height // 2,
-            "size": 40,
-        }
+        self._display_frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self._gray_frame = np.zeros((height, width), dtype=np.uint8)
+
+    def _render_frame(self, image):
+        height, width = self._display_frame.shape[:2]
+        is_scaled = image.shape[:2] != (height, width)
+
+        # Nearest neighbor is the cheapest at any scale, the other
+        # filters cost several times more at non-integer ratios.
+        if image.ndim == 2:
+            if is_scaled:
+                image = cv2.resize(image, (width, height), dst=self._gray_frame, interpolation=cv2.INTER_NEAREST)
+
+            cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=self._display_frame)
+        elif is_scaled:
+            cv2.resize(image, (width, height), dst=self._display_frame, interpolation=cv2.INTER_NEAREST)
+        else:
+            np.copyto(self._display_frame, image)
 
     def _draw_overlay(self, frame):
-        if self._reticle is None:
-            return
+        with self._lock:
+            if self._overlay_shapes is None:
+                self._overlay_shapes = self._build_overlay()
 
-        x = self._reticle["x"]
-        y = self._reticle["y"]
+            polylines, labels = self._overlay_shapes
 
-        size = self._overlay["crosshair_size"]
-        color = self._overlay["color"]
         thickness = self._overlay["thickness"]
+        font_scale = self._overlay["font_scale"]
 
-        cv2.line(frame, (x - size, y), (x + size, y), color, thickness)
-        cv2.line(frame, (x, y - size), (x, y + size), color, thickness)
+        for color, points in polylines.items():
+            cv2.polylines(frame, points, False, color, thickness)
 
-        with self._lock:
-            if self._target is None:
-                self._draw_rect(frame, self._reticle)
-            else:
-                self._draw_rect(frame, self._target)
+        for text, position, color in labels:
+            cv2.putText(frame, text, position, cv2.FONT_HERSHEY_SIMPLEX, font_scale, color)
+
+    def _overlay_geometry(self):
+        """
+        Integer geometry of the reticle and targets as drawn, to
+        tell whether the overlay has to be rebuilt.
+        """
+
+        geometry = [(round(self._reticle["x"] * self._scale), round(self._reticle["y"] * self._scale))]
+
+        for target in self._targets or [self._reticle]:
+            geometry.append((
+                round(target["x"] * self._scale),
+                round(target["y"] * self._scale),
+                round(target["size"] * self._scale) // 2,
+                target.get("id"),
+                target.get("selected", True),
+            ))
+
+        return tuple(geometry)
 
-    def _draw_rect(self, frame, data):
-        x = data["x"]
-        y = data["y"]
-        size = data["size"] // 2
+    def _invalidate_overlay(self):
+        key = self._overlay_geometry()
+
+        if key != self._overlay_key:
+            self._overlay_key = key
+            self._overlay_shapes = None
+
+    def _build_overlay(self):
+        """
+        Polylines of the crosshair and target corners by color, and the
+        target labels, in preview coordinates.
+        """
 
         color = self._overlay["color"]
         thickness = self._overlay["thickness"]
 
-        cv2.line(frame, (x - size, y - size), (x - size, y - size // 2), color, thickness)
-        cv2.line(frame, (x - size, y - size), (x - size // 2, y - size), color, thickness)
+        x = round(self._reticle["x"] * self._scale)
+        y = round(self._reticle["y"] * self._scale)
+        size = self._overlay["crosshair_size"]
+
+        polylines = {
+            color: [
+                np.array([(x - size, y), (x + size, y)], dtype=np.int32),
+                np.array([(x, y - size), (x, y + size)], dtype=np.int32),
+            ],
+        }
+
+        labels = []
 
-        cv2.line(frame, (x + size, y - size), (x + size, y - size // 2), color, thickness)
-        cv2.line(frame, (x + size, y - size), (x + size // 2, y - size), color, thickness)
+        for target in self._targets or [self._reticle]:
+            if target.get("selected", True):
+                target_color = color
+            else:
+                target_color = self._overlay["secondary_color"]
+
+            x = round(target["x"] * self._scale)
+            y = round(target["y"] * self._scale)
+            size = round(target["size"] * self._scale) // 2
+
+            points = polylines.setdefault(target_color, [])
 
-        cv2.line(frame, (x - size, y + size), (x - size, y + size // 2), color, thickness)
-        cv2.line(frame, (x - size, y + size), (x - size // 2, y + size), color, thickness)
+            for sign_x, sign_y in ((-1, -1), (1, -1), (-1, 1), (1, 1)):
+                points.append(np.array([
+                    (x + sign_x * size, y + sign_y * (size // 2)),
+                    (x + sign_x * size, y + sign_y * size),
+                    (x + sign_x * (size // 2), y + sign_y * size),
+                ], dtype=np.int32))
 
-        cv2.line(frame, (x + size, y + size), (x + size, y + size // 2), color, thickness)
-        cv2.line(frame, (x + size, y + size), (x + size // 2, y + size), color, thickness)
+            if "id" in target:
+                position = (x - size, y - size - 2 * thickness)
+                labels.append((str(target["id"]), position, target_color))
+
+        return polylines, labels
 
     def send_event(self, event):
         self._controller.send_event(event)
 
+    def send_events(self, events):
+        self._controller.send_events(events)
+
     def update_reticle_size(self, size):
         with self._lock:
             self._reticle["size"] = size
+            self._invalidate_overlay()
 
     def update_target(self, target):
+        if target is None:
+            self.update_targets([])
+        else:
+            self.update_targets([target])
+
+    def update_targets(self, targets):
         with self._lock:
-            self._target = target
+            self._targets = targets
+            self._invalidate_overlay()
 
     def stop(self):
         if not self._is_running.is_set():
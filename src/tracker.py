@@ -1,38 +1,84 @@
 import cv2
+import time
 import numpy as np
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from profiler import Profiler
+from workspace import TrackerWorkspace
 from utils import (
+    IncrementalSKLM,
+    ParticleBudget,
+    check_float32,
+    effective_sample_size,
+    resample,
+    select_target,
     sklm,
     warp_image,
     warp_multiple_images,
 )
 
 
-class IncrementalTracker:
-    def __init__(self, camera, simulator, autopilot, config):
-        self._camera = camera
-        self._simulator = simulator
-        self._autopilot = autopilot
+def normalize_grayscale(frame, resize_rate=1.0, luma=None):
+    """
+    Float32 grayscale image of a frame in [0, 1], resized by `resize_rate`,
+    or the frame's luma plane when it has one.
 
-        self._nparticles = config["NPARTICLES"]
-        self._condenssig = config["CONDENSSIG"]
-        self._forgetting = config["FORGETTING"]
-        self._batch_size = config["BATCH_SIZE"]
+    Frames without a luma plane are converted with the same arithmetic as
+    the camera's, so both give identical images, and a recorded flight
+    replays exactly.
+    """
 
-        template_size = config["TEMPLATE_SIZE"]
-        self._template_shape = (template_size, template_size)
-        self._template_dimension = template_size * template_size
+    if luma is not None:
+        grayscale_image = luma
+    else:
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        self._max_basis = config["MAX_BASIS"]
-        self._affsig = np.asarray(config["AFFSIG"], dtype=np.float32)
+        grayscale_image = np.multiply(frame, np.float32(1.0 / 255.0))
+
+    if resize_rate < 1.0:
+        height, width = grayscale_image.shape
+        size = (max(1, round(width * resize_rate)), max(1, round(height * resize_rate)))
+        grayscale_image = cv2.resize(grayscale_image, size, interpolation=cv2.INTER_AREA)
+
+    return grayscale_image
+
+
+class TargetSink:
+    """
+    Stands in for the simulator and autopilot when tracking offline,
+    discarding the published targets.
+    """
+
+    def update_target(self, target):
+        pass
+
+    def update_targets(self, targets):
+        pass
+
+
+class TrackerBase:
+    """
+    Frame loop shared by the trackers: once tracking, every new frame of
+    `camera` is handed to `process`, which subclasses implement along
+    with `init` and `reset`.
+    """
+
+    def __init__(self, camera, simulator, autopilot, profiler=None, recorder=None):
+        self._camera = camera
+        self._simulator = simulator
+        self._autopilot = autopilot
+        self._profiler = profiler or Profiler()
+        self._recorder = recorder
 
         self._lock = threading.Lock()
         self._is_running = threading.Event()
         self._is_tracking = threading.Event()
 
         self._initial_box = None
-        self._reset_params()
+        self._frame_id = 0
+        self._frame_timeout = 0.1
 
     def run(self):
         thread = threading.Thread(target=self._run, daemon=True)
@@ -46,14 +92,13 @@ class IncrementalTracker:
             while self._is_running.is_set():
                 self._is_tracking.wait()
 
-                with self._lock:
-                    frame = self._camera.read()
+                frame = self._camera.wait_for_frame(self._frame_id, self._frame_timeout)
 
-                    if frame is None:
-                        continue
+                if frame is None:
+                    continue
 
-                    est = self._track(frame)
-                    self._update_target(est)
+                with frame:
+                    self.process(frame)
         except Exception as error:
             logging.error(error)
         finally:
@@ -68,159 +113,674 @@ class IncrementalTracker:
             "size": 20,
         }
 
-    def init(self):
-        if self._is_tracking.is_set():
+    def set_initial_box(self, box):
+        self._initial_box = dict(box)
+
+    def update_initial_box(self, size):
+        self._initial_box["size"] = size
+
+    def is_tracking(self):
+        return self._is_tracking.is_set()
+
+    def stop(self):
+        if not self._is_running.is_set():
             return
 
-        if self._initial_box is None:
+        self._is_running.clear()
+        self.reset()
+
+
+class IncrementalTracker(TrackerBase):
+    """
+    Tracks one target with an incremental appearance model and a
+    particle filter.
+
+    `process` runs the stages of a frame in order: `collect_model_update`
+    and `propagate_particles`,
+    `particle_region` and `pyramid_rate` to prepare the grayscale image,
+    `warp_params` and `evaluate_likelihood` on the warped particles, then
+    `update_models` and `update_particle_budget`. `MultiTargetTracker`
+    calls these stages directly to warp the particles of all its targets
+    in one pass.
+    """
+
+    def __init__(self, camera, simulator, autopilot, config, profiler=None, recorder=None):
+        super().__init__(camera, simulator, autopilot, profiler, recorder)
+        self._frame_scale = camera.get_scale()
+
+        self._nparticles = config["NPARTICLES"]
+        self._condenssig = config["CONDENSSIG"]
+        self._forgetting = config["FORGETTING"]
+        self._batch_size = config["BATCH_SIZE"]
+
+        self._rng = np.random.Generator(np.random.PCG64(config["SEED"]))
+        # Recorded runs are replayed from the generator state, so
+        # they must not depend on thread timing either.
+        self._is_deterministic = config["SEED"] is not None or recorder is not None
+
+        self._resampling = config["RESAMPLING"]
+        self._resample_threshold = config["RESAMPLE_THRESHOLD"]
+
+        self._particle_budget = None
+        max_particles = self._nparticles
+
+        if config["ADAPTIVE_PARTICLES"]:
+            self._particle_budget = ParticleBudget(
+                config["FRAME_BUDGET"],
+                config["MIN_PARTICLES"],
+                config["MAX_PARTICLES"],
+                config["TARGET_EFFECTIVE_PARTICLES"],
+                self._nparticles,
+            )
+
+            self._nparticles = self._particle_budget.get_count()
+            max_particles = self._particle_budget.get_max_count()
+
+        self._roi = config["ROI"]
+        self._roi_margin = config["ROI_MARGIN"]
+
+        self._resize_rate = config["RESIZE_RATE"]
+        self._pyramid_levels = config["PYRAMID_LEVELS"]
+
+        template_size = config["TEMPLATE_SIZE"]
+        self._template_shape = (template_size, template_size)
+        self._template_dimension = template_size * template_size
+
+        self._max_basis = config["MAX_BASIS"]
+        self._max_staleness = config["MAX_MODEL_STALENESS"]
+
+        self._update_executor = None
+        self._pending_update = None
+        self._pending_frames = 0
+
+        if config["ASYNC_MODEL_UPDATE"]:
+            self._update_executor = ThreadPoolExecutor(max_workers=1)
+
+        self._sklm_engine = None
+
+        if config["SKLM"] == "incremental":
+            self._sklm_engine = IncrementalSKLM(
+                self._template_dimension,
+                self._max_basis,
+                self._batch_size,
+                self._forgetting,
+            )
+
+        self._affsig = np.asarray(config["AFFSIG"], dtype=np.float32)
+
+        self._motion_model = config["MOTION_MODEL"]
+        self._motion_smoothing = config["MOTION_SMOOTHING"]
+
+        self._workspace = self._create_workspace(max_particles)
+
+        self._reset_params()
+
+    def _create_workspace(self, max_particles):
+        dof = self._affsig.size
+        dimension = self._template_dimension
+
+        particle_sizes = {
+            "param": dof,
+            "resampled": dof,
+            "noise": dof,
+            "warp_param": dof,
+            "conf": 1,
+            "error": 1,
+            "warp": dimension,
+            "map_x": dimension,
+            "map_y": dimension,
+            "diff": dimension,
+            "squared": dimension,
+            "scratch": dimension,
+            "projection": self._max_basis,
+        }
+
+        # Two halves of batches, one filled by the tracker while
+        # the other is read by a pending model update.
+        shapes = {
+            "est": (dof,),
+            "wimg": self._template_shape,
+            "err": self._template_shape,
+            "recon": self._template_shape,
+            "batch": (2, self._batch_size, dimension),
+        }
+
+        return TrackerWorkspace(max_particles, particle_sizes, shapes)
+
+    def process(self, frame):
+        """
+        Track the target in one frame and publish it.
+
+        The returned estimate is a workspace buffer overwritten
+        by the next frame.
+        """
+
+        with self._lock:
+            if not self._is_tracking.is_set():
+                return None
+
+            self._frame_id = frame.id
+
+            with self._profiler.span("track"):
+                est = self._track(frame.image, frame.luma)
+
+            self._profiler.set_gauge("particles", self._nparticles)
+            self._profiler.set_gauge("basis_size", self.get_basis_size())
+
+            self._update_target(est, frame.timestamp)
+
+            if self._recorder is not None:
+                self._recorder.record_state(frame.id, frame.timestamp, est, self._params["conf"])
+                self._recorder.record_frame(frame.id, frame.timestamp, frame.image)
+
+            return est
+
+    def get_rng_state(self):
+        """
+        State of the random number generator, to checkpoint a run.
+        """
+
+        with self._lock:
+            return self._rng.bit_generator.state
+
+    def set_rng_state(self, state):
+        """
+        Restore a state returned by `get_rng_state`, so that the
+        run continues with the same random numbers.
+        """
+
+        with self._lock:
+            self._rng.bit_generator.state = state
+
+    def init(self, initial_params=None):
+        """
+        Start tracking the target in the initial box, or at the given
+        state parameters (used to replay a recorded flight).
+        """
+
+        if self._is_tracking.is_set():
             return
 
-        degrees_of_freedom = self._affsig.size
-        initial_params = np.zeros(degrees_of_freedom, dtype=np.float32)
+        if initial_params is None:
+            if self._initial_box is None:
+                return
 
-        initial_params[0] = self._initial_box["x"]
-        initial_params[1] = self._initial_box["y"]
-        initial_params[2] = self._initial_box["size"] / self._template_shape[0]
-        initial_params[3] = 1.0
+            degrees_of_freedom = self._affsig.size
+            initial_params = np.zeros(degrees_of_freedom, dtype=np.float32)
 
-        frame = self._camera.read()
+            initial_params[0] = self._initial_box["x"]
+            initial_params[1] = self._initial_box["y"]
+            initial_params[2] = self._initial_box["size"] / self._frame_scale[0] / self._template_shape[0]
+            initial_params[3] = 1.0
+        else:
+            initial_params = np.asarray(initial_params, dtype=np.float32)
+
+        frame = self._camera.lease()
 
         if frame is None:
             return
 
-        grayscale_image = self._normalize_grayscale(frame)
-        mean_2d = warp_image(grayscale_image, initial_params, self._template_shape)
+        with frame:
+            self._frame_id = frame.id
+
+            grayscale_image = normalize_grayscale(frame.image, luma=frame.luma)
+            mean_2d = warp_image(grayscale_image, initial_params, self._template_shape)
+
+            # The template may be a view into the frame's luma plane,
+            # copy it before the ring slot is released.
+            self._template["mean"] = mean_2d.flatten()
+            self._params["wimg"] = mean_2d.copy()
+
+            if self._recorder is not None:
+                self._recorder.record_frame(frame.id, frame.timestamp, frame.image)
+                self._recorder.record_init(frame.id, frame.timestamp, initial_params, self.get_rng_state())
 
-        self._template["mean"] = mean_2d.flatten()
-        self._params["wimg"] = mean_2d.copy()
         self._params["est"] = initial_params.copy()
 
+        self._motion["position"] = initial_params[:2].copy()
+        self._motion["frame_id"] = self._frame_id
+
         self._is_tracking.set()
 
-    def _track(self, frame):
-        grayscale_image = self._normalize_grayscale(frame)
-        self._estimate_warp_condensation(grayscale_image)
+    def _track(self, frame, luma=None):
+        start_time = time.perf_counter()
 
-        if len(self._warped_images) < self._batch_size:
-            return self._params["est"]
+        with self._profiler.span("sklm"):
+            self.collect_model_update()
 
-        if "coef" in self._params:
-            reconstruction = self._template["basis"] @ self._params["coef"]
-            reconstructed_image = (reconstruction.T + self._template["mean"]).T
+        with self._profiler.span("resample"):
+            self.propagate_particles(self._frame_id)
 
-            self._update_model()
+        with self._profiler.span("grayscale"):
+            if self._roi:
+                left, top, right, bottom = self.particle_region(frame.shape)
+                frame = frame[top:bottom, left:right]
 
-            recon = (reconstructed_image.T - self._template["mean"]).T
-            self._params["coef"] = self._template["basis"].T @ recon
-        else:
-            self._update_model()
+                if luma is not None:
+                    luma = luma[top:bottom, left:right]
+            else:
+                left, top = 0, 0
 
-        self._warped_images = []
-        current_eigenvector_count = self._template["basis"].shape[1]
+            resize_rate = self.pyramid_rate()
+            grayscale_image = normalize_grayscale(frame, resize_rate, luma)
 
-        if current_eigenvector_count > self._max_basis:
-            _sum = np.sum(np.power(self._template["eigval"][self._max_basis:], 2))
-            self._template["reseig"] = self._forgetting * self._template["reseig"] + _sum
+        assert check_float32(grayscale=grayscale_image)
 
-            self._template["basis"] = self._template["basis"][:, :self._max_basis]
-            self._template["eigval"] = self._template["eigval"][:self._max_basis]
+        scale = (
+            grayscale_image.shape[1] / frame.shape[1],
+            grayscale_image.shape[0] / frame.shape[0],
+        )
 
-            if "coef" in self._params:
-                self._params["coef"] = self._params["coef"][:self._max_basis]
+        particle_time = time.perf_counter()
+        self._estimate_warp_condensation(grayscale_image, (left, top), scale)
+        particle_time = time.perf_counter() - particle_time
 
-        return self._params["est"]
+        self.update_models()
+        self.update_particle_budget(time.perf_counter() - start_time, particle_time)
 
-    def _estimate_warp_condensation(self, grayscale_image):
-        if "param" not in self._params:
-            self._params["param"] = np.tile(self._params["est"], (self._nparticles, 1))
-        else:
-            cumulative_confidence = np.cumsum(self._params["conf"])
-            random_samples = np.random.random(self._nparticles)
-            cdf_indices = np.zeros(self._nparticles, dtype=np.int32)
+        assert self.is_single_precision()
 
-            for i in range(self._nparticles):
-                cdf_indices[i] = np.searchsorted(
-                    cumulative_confidence,
-                    random_samples[i],
-                )
+        return self._params["est"]
 
-                if cdf_indices[i] == self._nparticles:
-                    cdf_indices[i] -= 1
+    def is_single_precision(self):
+        """
+        Check that the particle, appearance and motion state is float32,
+        so no step silently promotes it to float64.
+        """
 
-            self._params["param"] = self._params["param"][cdf_indices]
+        return check_float32(**self._params, **self._template, **self._motion)
 
-        self._params["param"] = np.random.normal(self._params["param"], self._affsig)
+    def update_particle_budget(self, frame_time, particle_time):
+        """
+        Adapt the particle count to the time the last frame took, when
+        the count is adaptive.
+        """
 
-        warped_images_array = warp_multiple_images(
-            grayscale_image,
-            self._params["param"],
-            self._template_shape,
-        )
+        if self._particle_budget is None:
+            return
 
-        warped_images_flat = warped_images_array.reshape(
-            self._template_dimension,
+        self._particle_budget.update(
+            frame_time,
+            particle_time,
             self._nparticles,
+            effective_sample_size(self._params["conf"]),
         )
 
-        self._diff = warped_images_flat - self._template["mean"][:, np.newaxis]
+    def set_frame_budget(self, frame_budget):
+        if self._particle_budget is not None:
+            self._particle_budget.set_frame_budget(frame_budget)
+
+    def update_models(self):
+        """
+        Update the motion and appearance models with the last estimate.
+        """
+
+        self._update_motion()
+
+        if len(self._warped_images) >= self._batch_size:
+            self._submit_model_update()
+
+    def propagate_particles(self, frame_id):
+        """
+        Resample the particles if needed and move them to `frame_id`
+        with the motion model and random noise.
+        """
+
+        self._frame_id = frame_id
+        nparticles = self._nparticles
+
+        if self._particle_budget is not None:
+            nparticles = self._particle_budget.get_count()
+
+        workspace = self._workspace
+        shape = (self._affsig.size,)
+
+        if "param" not in self._params:
+            param = workspace.particles("param", nparticles, shape)
+            param[...] = self._params["est"]
+
+            self._nparticles = nparticles
+            self._params["conf"] = workspace.particles("conf", nparticles)
+            self._params["conf"].fill(1.0 / nparticles)
+        elif (
+            nparticles != self._nparticles
+            or effective_sample_size(self._params["conf"]) < self._resample_threshold * nparticles
+        ):
+            indices = resample(self._params["conf"], self._resampling, self._rng, nparticles)
+
+            resampled = workspace.particles("resampled", nparticles, shape)
+            np.take(self._params["param"], indices, axis=0, out=resampled)
+            workspace.swap("param", "resampled")
+            self._profiler.increment("resamples")
+
+            self._nparticles = nparticles
+            self._params["conf"] = workspace.particles("conf", nparticles)
+            self._params["conf"].fill(1.0 / nparticles)
+
+        param = workspace.particles("param", self._nparticles, shape)
+
+        if self._motion_model != "none":
+            param[:, :2] += self._predict_motion()
+
+        noise = workspace.particles("noise", self._nparticles, shape)
+        self._rng.standard_normal(dtype=np.float32, out=noise)
+        noise *= self._affsig
+        param += noise
+
+        self._params["param"] = param
+
+    def _predict_motion(self):
+        """
+        Displacement of the target expected since the last tracked frame,
+        counting frames that were skipped.
+        """
+
+        steps = self._frame_id - self._motion["frame_id"]
+        displacement = self._motion["velocity"] * steps
+
+        if self._motion_model == "acceleration":
+            displacement += 0.5 * self._motion["acceleration"] * steps * steps
+
+        return displacement
+
+    def _update_motion(self):
+        if self._motion_model == "none":
+            return
+
+        position = self._params["est"][:2]
+        steps = max(self._frame_id - self._motion["frame_id"], 1)
+
+        velocity = (position - self._motion["position"]) / steps
+        velocity = self._motion_smoothing * self._motion["velocity"] + (1 - self._motion_smoothing) * velocity
+
+        if self._motion_model == "acceleration":
+            acceleration = (velocity - self._motion["velocity"]) / steps
+
+            self._motion["acceleration"] = (
+                self._motion_smoothing * self._motion["acceleration"]
+                + (1 - self._motion_smoothing) * acceleration
+            )
+
+        self._motion["position"] = position.copy()
+        self._motion["velocity"] = velocity
+        self._motion["frame_id"] = self._frame_id
+
+    def particle_region(self, frame_shape):
+        """
+        Bounds (left, top, right, bottom) of the frame covered by
+        the particles.
+        """
+
+        params = self._params["param"]
+        frame_height, frame_width = frame_shape[:2]
+
+        width = np.abs(params[:, 2]) * self._template_shape[0]
+        height = np.abs(params[:, 3]) * width
+        radius = 0.5 * np.hypot(width, height) + self._roi_margin
+
+        left = int(np.floor(np.min(params[:, 0] - radius)))
+        top = int(np.floor(np.min(params[:, 1] - radius)))
+        right = int(np.ceil(np.max(params[:, 0] + radius))) + 1
+        bottom = int(np.ceil(np.max(params[:, 1] + radius))) + 1
+
+        left = min(max(0, left), frame_width - 1)
+        top = min(max(0, top), frame_height - 1)
+        right = max(min(frame_width, right), left + 1)
+        bottom = max(min(frame_height, bottom), top + 1)
+
+        return left, top, right, bottom
+
+    def pyramid_rate(self):
+        """
+        Resize rate of the coarsest pyramid level that still samples
+        the target at the template resolution.
+        """
+
+        est = self._params["est"]
+
+        width = est[2] * self._template_shape[0]
+        height = est[3] * width
+        patch_size = min(abs(width), abs(height))
+
+        level = 0
+
+        while level + 1 < self._pyramid_levels:
+            if patch_size * self._resize_rate ** (level + 1) < self._template_shape[0]:
+                break
+
+            level += 1
+
+        return self._resize_rate ** level
+
+    def _estimate_warp_condensation(self, grayscale_image, origin=(0, 0), scale=(1.0, 1.0)):
+        with self._profiler.span("warp"):
+            dimension = self._template_dimension
+
+            warped_images_array = warp_multiple_images(
+                grayscale_image,
+                self.warp_params(origin, scale),
+                self._template_shape,
+                out=self._workspace.columns("warp", dimension, self._nparticles),
+                maps=(
+                    self._workspace.columns("map_x", dimension, self._nparticles),
+                    self._workspace.columns("map_y", dimension, self._nparticles),
+                ),
+            )
+
+        with self._profiler.span("likelihood"):
+            self.evaluate_likelihood(warped_images_array)
+
+    def warp_params(self, origin=(0, 0), scale=(1.0, 1.0)):
+        """
+        Particle parameters in the coordinates of a cropped
+        and resized grayscale image.
+        """
+
+        params = self._params["param"]
+
+        if origin != (0, 0) or scale != (1.0, 1.0):
+            warp_params = self._workspace.particles("warp_param", len(params), params.shape[1:])
+            np.copyto(warp_params, params)
+            params = warp_params
+
+            params[:, 0] -= origin[0] - 0.5
+            params[:, 0] *= scale[0]
+            params[:, 0] -= 0.5
+
+            params[:, 1] -= origin[1] - 0.5
+            params[:, 1] *= scale[1]
+            params[:, 1] -= 0.5
+
+            params[:, 2] *= scale[0]
+            params[:, 3] *= scale[1] / scale[0]
+
+        return params
+
+    def evaluate_likelihood(self, warped_images_array):
+        """
+        Weigh the particles by the likelihood of their warped images, one
+        column per particle, and take the most likely one as the estimate.
+        """
+
+        workspace = self._workspace
+        dimension = self._template_dimension
+
+        warped_images_flat = warped_images_array.reshape(dimension, self._nparticles)
+
+        diff = workspace.columns("diff", dimension, self._nparticles)
+        scratch = workspace.columns("scratch", dimension, self._nparticles)
+
+        np.subtract(warped_images_flat, self._template["mean"][:, np.newaxis], out=diff)
         current_eigenvector_count = self._template["basis"].shape[1]
 
         if current_eigenvector_count > 0:
-            projection = self._template["basis"].T @ self._diff
+            projection = workspace.columns("projection", current_eigenvector_count, self._nparticles)
+            np.matmul(self._template["basis"].T, diff, out=projection)
 
-            self._diff -= self._template["basis"] @ projection
+            np.matmul(self._template["basis"], projection, out=scratch)
+            diff -= scratch
             self._params["coef"] = projection
 
-        squared_diff = np.power(self._diff, 2)
+        squared_diff = workspace.columns("squared", dimension, self._nparticles)
+        np.square(diff, out=squared_diff)
         precision = 1.0 / self._condenssig
 
         robust_sigma = 0.1
-        error = np.sum(squared_diff / (squared_diff + robust_sigma), axis=0) * -precision
-        self._params["conf"] = np.exp(error)
+        np.add(squared_diff, robust_sigma, out=scratch)
+        np.divide(squared_diff, scratch, out=scratch)
 
+        error = workspace.particles("error", self._nparticles)
+        np.sum(scratch, axis=0, out=error)
+        error *= -precision
+        error -= np.max(error)
+        np.exp(error, out=error)
+
+        self._params["conf"] *= error
         self._params["conf"] /= np.sum(self._params["conf"])
         max_index = np.argmax(self._params["conf"])
 
-        self._params["est"] = self._params["param"][max_index].copy()
-        self._params["wimg"] = warped_images_array[:, :, max_index].copy()
-        self._params["err"] = self._diff[:, max_index].reshape(self._template_shape)
-        self._params["recon"] = self._params["wimg"] + self._params["err"]
+        self._params["est"] = workspace.array("est")
+        self._params["wimg"] = workspace.array("wimg")
+        self._params["err"] = workspace.array("err")
+        self._params["recon"] = workspace.array("recon")
+
+        np.copyto(self._params["est"], self._params["param"][max_index])
+        np.copyto(self._params["wimg"], warped_images_array[:, :, max_index])
+        np.copyto(self._params["err"], diff[:, max_index].reshape(self._template_shape))
+        np.add(self._params["wimg"], self._params["err"], out=self._params["recon"])
+
+        sample = workspace.array("batch")[self._batch_half, len(self._warped_images)]
+        np.copyto(sample, self._params["wimg"].reshape(dimension))
+        self._warped_images.append(sample)
+
+    def _submit_model_update(self):
+        if self._pending_update is not None:
+            self._apply_model_update(self._pending_update.result())
+            self._pending_update = None
+
+        template = {
+            "basis": self._template["basis"],
+            "eigval": self._template["eigval"],
+            "mean": self._template["mean"],
+            "nsamples": self._template["nsamples"],
+        }
+
+        if self._update_executor is None:
+            update = self._compute_model_update(self._warped_images, template)
+            self._apply_model_update(update)
+        else:
+            self._pending_update = self._update_executor.submit(
+                self._compute_model_update,
+                self._warped_images,
+                template,
+            )
 
-        self._warped_images.append(self._params["wimg"].flatten())
+            self._pending_frames = 0
 
-    def _normalize_grayscale(self, frame):
-        grayscale_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        return np.float32(grayscale_image) / 255.0
+        self._warped_images = []
+        self._batch_half = 1 - self._batch_half
 
-    def _update_model(self):
-        basis, eigval, mean, nsamples = sklm(
-            self._warped_images,
-            self._template,
-            self._forgetting,
-        )
+    def collect_model_update(self):
+        """
+        Apply a pending appearance model update before the frame is
+        scored, once it is done or `MAX_MODEL_STALENESS` frames old.
+        """
+
+        if self._pending_update is None:
+            return
+
+        self._pending_frames += 1
+
+        # A seeded or recorded run must not depend on thread timing,
+        # so its updates always land after the same number of frames.
+        is_ready = self._pending_update.done() and not self._is_deterministic
+
+        if is_ready or self._pending_frames > self._max_staleness:
+            self._apply_model_update(self._pending_update.result())
+            self._pending_update = None
+
+    def _compute_model_update(self, data_list, template):
+        # Timed where it runs, on the update worker when asynchronous; the
+        # "sklm" stage only covers collecting updates then.
+        with self._profiler.span("model_update"):
+            if self._sklm_engine is not None:
+                return self._sklm_engine.update(data_list, template)
+
+            basis, eigval, mean, nsamples = sklm(data_list, template, self._forgetting)
+            discarded = float(np.sum(np.power(eigval[self._max_basis:], 2)))
+
+            return basis[:, :self._max_basis], eigval[:self._max_basis], mean, nsamples, discarded
+
+    def _apply_model_update(self, update):
+        basis, eigval, mean, nsamples, discarded = update
+
+        previous_basis = self._template["basis"]
+        previous_mean = self._template["mean"]
+
+        if discarded > 0:
+            self._template["reseig"] = np.float32(self._forgetting * self._template["reseig"] + discarded)
 
         self._template["basis"] = basis
         self._template["eigval"] = eigval
         self._template["mean"] = mean
         self._template["nsamples"] = nsamples
 
-    def _update_target(self, est):
-        est_width = est[2] * self._template_shape[0]
-        est_height = est_width * est[3]
+        if self._recorder is not None:
+            self._recorder.record_basis(self._frame_id, mean, basis, eigval)
+
+        if "coef" in self._params:
+            # Re-express the coefficients in the new basis without
+            # reconstructing every particle's image.
+            rotation = basis.T @ previous_basis
+            offset = basis.T @ (previous_mean - mean)
+
+            self._params["coef"] = rotation @ self._params["coef"] + offset[:, np.newaxis]
+
+    def _update_target(self, est, timestamp):
+        target = self.target_box(est, timestamp)
+
+        self._simulator.update_target(target)
+        self._autopilot.update_target(target)
+
+    def target_box(self, est, timestamp):
+        """
+        Target at the state `est`, in the coordinates of the original
+        frame.
+        """
+
+        scale_x, scale_y = self._frame_scale
+
+        est_width = est[2] * self._template_shape[0] * scale_x
+        est_height = est[3] * est[2] * self._template_shape[0] * scale_y
 
         target_size = min(est_width, est_height)
 
         target = {
-            "x": int(est[0]),
-            "y": int(est[1]),
+            "x": int(est[0] * scale_x),
+            "y": int(est[1] * scale_y),
             "size": int(target_size),
+            "timestamp": timestamp,
         }
 
-        self._simulator.update_target(target)
-        self._autopilot.update_target(target)
+        return target
 
-    def update_initial_box(self, size):
-        self._initial_box["size"] = size
+    def get_estimate(self):
+        return self._params["est"]
+
+    def get_weights(self):
+        return self._params["conf"]
+
+    def get_particle_count(self):
+        return self._nparticles
+
+    def get_max_particles(self):
+        return self._workspace.get_max_particles()
+
+    def get_state_size(self):
+        return self._affsig.size
+
+    def get_basis_size(self):
+        return self._template["basis"].shape[1]
 
     def reset(self):
         self._is_tracking.clear()
@@ -229,8 +789,25 @@ class IncrementalTracker:
             self._reset_params()
             self._simulator.update_target(None)
 
+    def clear(self):
+        """
+        Forget the target without publishing it, for trackers
+        driven by `MultiTargetTracker`.
+        """
+
+        self._is_tracking.clear()
+
+        with self._lock:
+            self._reset_params()
+
     def _reset_params(self):
+        if self._pending_update is not None:
+            # The update may still be writing into the sklm workspace.
+            self._pending_update.exception()
+            self._pending_update = None
+
         self._warped_images = []
+        self._batch_half = 0
 
         self._params = {
             "conf": np.full(
@@ -245,17 +822,283 @@ class IncrementalTracker:
             "basis": np.zeros((self._template_dimension, 0), dtype=np.float32),
             "eigval": np.array([], dtype=np.float32),
             "nsamples": 0,
-            "reseig": 0,
+            "reseig": np.float32(0),
         }
 
-        self._diff = np.zeros(
-            (self._template_dimension, self._nparticles),
-            dtype=np.float32,
-        )
+        self._motion = {
+            "position": np.zeros(2, dtype=np.float32),
+            "velocity": np.zeros(2, dtype=np.float32),
+            "acceleration": np.zeros(2, dtype=np.float32),
+            "frame_id": 0,
+        }
 
-    def stop(self):
-        if not self._is_running.is_set():
+
+class MultiTargetTracker(TrackerBase):
+    """
+    Tracks several targets over the same frames, each with its own
+    particle cloud and appearance model.
+
+    The grayscale image is prepared once per frame over the region
+    covered by all particle clouds, and the particles of every target
+    are warped in a single pass before each model evaluates its own
+    likelihood. The autopilot follows one target, chosen by the
+    configured selection policy unless one is selected explicitly.
+    """
+
+    def __init__(self, camera, simulator, autopilot, config, profiler=None, recorder=None):
+        super().__init__(camera, simulator, autopilot, profiler, recorder)
+        self._config = config
+
+        self._max_targets = config["MAX_TARGETS"]
+        self._seed_sequence = np.random.SeedSequence(config["SEED"])
+        self._selection = config["TARGET_SELECTION"]
+        self._roi = config["ROI"]
+        self._frame_budget = config["FRAME_BUDGET"]
+
+        template_size = config["TEMPLATE_SIZE"]
+        self._template_shape = (template_size, template_size)
+        self._template_dimension = template_size * template_size
+
+        width, height = camera.get_resolution()
+        scale_x, scale_y = camera.get_scale()
+        self._center = (width * scale_x / 2, height * scale_y / 2)
+
+        self._targets = {}
+        self._next_target_id = 1
+        self._selected_id = None
+        self._workspace = None
+
+    def process(self, frame):
+        with self._lock:
+            if not self._is_tracking.is_set():
+                return None
+
+            self._frame_id = frame.id
+
+            with self._profiler.span("track"):
+                estimates = self._track(frame.image, frame.luma)
+
+            self._profiler.set_gauge("targets", len(estimates))
+
+            self._update_targets(estimates, frame.timestamp)
+
+            if self._recorder is not None:
+                self._recorder.record_frame(frame.id, frame.timestamp, frame.image)
+
+            return estimates
+
+    def init(self):
+        """
+        Lock a new target at the initial box, next to the ones
+        already being tracked.
+        """
+
+        if self._initial_box is None:
             return
 
-        self._is_running.clear()
-        self.reset()
+        with self._lock:
+            if len(self._targets) >= self._max_targets:
+                logging.warning(f"Already tracking {self._max_targets} targets")
+                return
+
+            config = dict(self._config)
+
+            if config["SEED"] is not None:
+                # Every target draws from its own independent stream.
+                config["SEED"] = self._seed_sequence.spawn(1)[0]
+
+            model = IncrementalTracker(
+                self._camera,
+                self._simulator,
+                self._autopilot,
+                config,
+                self._profiler,
+            )
+
+            model.set_initial_box(self._initial_box)
+            model.init()
+
+            if not model.is_tracking():
+                return
+
+            self._targets[self._next_target_id] = model
+            self._next_target_id += 1
+
+            self._allocate_workspace()
+
+        self._is_tracking.set()
+
+    def _allocate_workspace(self):
+        max_particles = sum(model.get_max_particles() for model in self._targets.values())
+        dof = next(iter(self._targets.values())).get_state_size()
+
+        particle_sizes = {
+            "param": dof,
+            "warp": self._template_dimension,
+            "map_x": self._template_dimension,
+            "map_y": self._template_dimension,
+        }
+
+        self._workspace = TrackerWorkspace(max_particles, particle_sizes)
+
+        # Adaptive particle counts share the frame budget between targets.
+        for model in self._targets.values():
+            model.set_frame_budget(self._frame_budget / len(self._targets))
+
+    def _track(self, frame, luma=None):
+        start_time = time.perf_counter()
+        models = list(self._targets.values())
+
+        with self._profiler.span("sklm"):
+            for model in models:
+                model.collect_model_update()
+
+        with self._profiler.span("resample"):
+            for model in models:
+                model.propagate_particles(self._frame_id)
+
+        with self._profiler.span("grayscale"):
+            if self._roi:
+                regions = np.array([model.particle_region(frame.shape) for model in models])
+
+                left, top = (int(value) for value in np.min(regions[:, :2], axis=0))
+                right, bottom = (int(value) for value in np.max(regions[:, 2:], axis=0))
+
+                frame = frame[top:bottom, left:right]
+
+                if luma is not None:
+                    luma = luma[top:bottom, left:right]
+            else:
+                left, top = 0, 0
+
+            # Use the finest pyramid level any target needs, so no target is
+            # sampled more coarsely than it would be when tracked alone.
+            resize_rate = max(model.pyramid_rate() for model in models)
+            grayscale_image = normalize_grayscale(frame, resize_rate, luma)
+
+        assert check_float32(grayscale=grayscale_image)
+
+        scale = (
+            grayscale_image.shape[1] / frame.shape[1],
+            grayscale_image.shape[0] / frame.shape[0],
+        )
+
+        particle_time = time.perf_counter()
+
+        with self._profiler.span("warp"):
+            counts = [model.get_particle_count() for model in models]
+            nparticles = sum(counts)
+            dimension = self._template_dimension
+
+            params = self._workspace.particles("param", nparticles, (models[0].get_state_size(),))
+            start = 0
+
+            for model, count in zip(models, counts):
+                stop = start + count
+                np.copyto(params[start:stop], model.warp_params((left, top), scale))
+                start = stop
+
+            warped_images_array = warp_multiple_images(
+                grayscale_image,
+                params,
+                self._template_shape,
+                out=self._workspace.columns("warp", dimension, nparticles),
+                maps=(
+                    self._workspace.columns("map_x", dimension, nparticles),
+                    self._workspace.columns("map_y", dimension, nparticles),
+                ),
+            )
+
+        with self._profiler.span("likelihood"):
+            start = 0
+
+            for model, count in zip(models, counts):
+                stop = start + count
+                model.evaluate_likelihood(warped_images_array[:, :, start:stop])
+                start = stop
+
+        particle_time = time.perf_counter() - particle_time
+
+        for model in models:
+            model.update_models()
+
+        frame_time = time.perf_counter() - start_time
+        fixed_time = (frame_time - particle_time) / len(models)
+
+        for model, count in zip(models, counts):
+            share = particle_time * count / nparticles
+            model.update_particle_budget(fixed_time + share, share)
+
+        assert all(model.is_single_precision() for model in models)
+
+        return {target_id: model.get_estimate() for target_id, model in self._targets.items()}
+
+    def _update_targets(self, estimates, timestamp):
+        targets = []
+
+        for target_id, est in estimates.items():
+            target = self._targets[target_id].target_box(est, timestamp)
+            target["id"] = target_id
+            targets.append(target)
+
+        if self._selected_id in estimates:
+            selected_id = self._selected_id
+        else:
+            selected_id = select_target(targets, self._selection, self._center)["id"]
+
+        for target in targets:
+            target["selected"] = target["id"] == selected_id
+
+            if target["selected"]:
+                self._autopilot.update_target(target)
+
+                if self._recorder is not None:
+                    model = self._targets[selected_id]
+                    self._recorder.record_state(self._frame_id, timestamp, estimates[selected_id], model.get_weights())
+
+        self._simulator.update_targets(targets)
+
+    def set_selected_target(self, target_id):
+        """
+        Make the autopilot follow the given target, or fall back to the
+        selection policy when `target_id` is None.
+        """
+
+        with self._lock:
+            self._selected_id = target_id
+
+    def remove_target(self, target_id):
+        with self._lock:
+            model = self._targets.pop(target_id, None)
+
+            if model is None:
+                return
+
+            model.clear()
+
+            if self._selected_id == target_id:
+                self._selected_id = None
+
+            if self._targets:
+                self._allocate_workspace()
+            else:
+                self._is_tracking.clear()
+                self._simulator.update_target(None)
+
+    def get_target_ids(self):
+        with self._lock:
+            return list(self._targets)
+
+    def reset(self):
+        self._is_tracking.clear()
+
+        with self._lock:
+            for model in self._targets.values():
+                model.clear()
+
+            self._targets = {}
+            self._selected_id = None
+            self._workspace = None
+
+            self._simulator.update_target(None)
+
@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class TrackerWorkspace:
+    """
+    Buffers reused by every frame of the particle filter, so that the
+    hot loop writes into them instead of allocating new arrays.
+
+    Per-particle buffers are allocated once for `max_particles` and kept
+    flat; `particles` and `columns` return their contiguous leading part
+    for the current particle count, with one row or one column per
+    particle.
+
+    Parameters
+    ----------
+    max_particles : int
+        Largest particle count the buffers must hold
+    particle_sizes : dict
+        Number of values per particle of each per-particle buffer
+    shapes : dict, optional
+        Shapes of the buffers that don't depend on the particle count
+    dtype : data-type, optional
+        Data type of all buffers
+    """
+
+    def __init__(self, max_particles, particle_sizes, shapes=None, dtype=np.float32):
+        self._max_particles = max_particles
+
+        self._buffers = {
+            name: np.empty(size * max_particles, dtype=dtype)
+            for name, size in particle_sizes.items()
+        }
+
+        self._arrays = {
+            name: np.empty(shape, dtype=dtype)
+            for name, shape in (shapes or {}).items()
+        }
+
+    def get_max_particles(self):
+        return self._max_particles
+
+    def particles(self, name, n_particles, shape=()):
+        """
+        View of a buffer as an array of shape (n_particles, *shape).
+        """
+
+        size = n_particles * int(np.prod(shape))
+        return self._buffers[name][:size].reshape(n_particles, *shape)
+
+    def columns(self, name, rows, n_particles):
+        """
+        View of a buffer as an array of shape (rows, n_particles).
+        """
+
+        return self._buffers[name][:rows * n_particles].reshape(rows, n_particles)
+
+    def array(self, name):
+        return self._arrays[name]
+
+    def swap(self, first, second):
+        """
+        Exchange two per-particle buffers, for double buffering.
+        """
+
+        self._buffers[first], self._buffers[second] = self._buffers[second], self._buffers[first]
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+from benchmark import SyntheticVideo
+from camera import Frame
+from config import TRACKER_CONFIG
+from profiler import Profiler
+from recorder import FlightRecorder
+from replay import RecordedFlight, replay
+from tracker import IncrementalTracker, TargetSink
+
+
+RESOLUTION = (480, 320)
+TARGET_SIZE = 48
+FRAMES = 60
+
+
+class LumaVideo(SyntheticVideo):
+    """
+    Synthetic frames with the float32 luma plane the camera publishes.
+    """
+
+    def lease(self):
+        frame = super().lease()
+
+        gray = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
+        luma = np.multiply(gray, np.float32(1.0 / 255.0))
+
+        return Frame(None, None, frame.image, frame.id, frame.timestamp, luma)
+
+
+def test_replay_of_luma_frames_does_not_drift(tmp_path):
+    path = str(tmp_path / "flight.rec")
+
+    # Every frame stays queued until written, so none is dropped.
+    recorder = FlightRecorder(path, record_frames=True, frame_scale=1.0, frame_buffers=FRAMES + 1)
+    recorder.run()
+
+    video = LumaVideo(RESOLUTION, TARGET_SIZE, 1.0, 0)
+    sink = TargetSink()
+
+    config = dict(TRACKER_CONFIG)
+    config["SEED"] = None
+
+    tracker = IncrementalTracker(video, sink, sink, config, Profiler(), recorder)
+    width, height = video.get_resolution()
+    tracker.set_initial_box({"x": width // 2, "y": height // 2, "size": TARGET_SIZE})
+    tracker.init()
+
+    for _ in range(FRAMES):
+        video.advance()
+        tracker.process(video.lease())
+
+    recorder.stop()
+
+    divergence = replay(RecordedFlight(path), TRACKER_CONFIG)
+
+    assert len(divergence) == FRAMES
+    assert max(error for _, error in divergence) == 0.0
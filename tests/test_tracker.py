@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+import pytest
+from benchmark import SyntheticVideo, run_benchmark
+from config import TRACKER_CONFIG, VIDEO_RESOLUTION
+from profiler import Profiler
+from tracker import IncrementalTracker, TargetSink, normalize_grayscale
+from utils import IncrementalSKLM, check_float32, sklm, warp_image, warp_multiple_images
+
+
+TARGET_SIZE = 48
+FRAMES = 150
+
+
+def create_config(seed, **overrides):
+    config = dict(TRACKER_CONFIG)
+    config["SEED"] = seed
+    config.update(overrides)
+
+    return config
+
+
+def track(config, frames=FRAMES, seed=0):
+    video = SyntheticVideo(VIDEO_RESOLUTION, TARGET_SIZE, 1.0, seed)
+    sink = TargetSink()
+
+    tracker = IncrementalTracker(video, sink, sink, config, Profiler())
+    width, height = video.get_resolution()
+    tracker.set_initial_box({"x": width // 2, "y": height // 2, "size": TARGET_SIZE})
+    tracker.init()
+
+    estimates = []
+
+    for _ in range(frames):
+        video.advance()
+        estimates.append(tracker.process(video.lease()).copy())
+
+    return tracker, np.array(estimates)
+
+
+@pytest.mark.parametrize("sklm", ["incremental", "reference"])
+def test_seeded_tracking_accuracy(sklm):
+    video = SyntheticVideo(VIDEO_RESOLUTION, TARGET_SIZE, 1.0, 0)
+    result = run_benchmark(video, create_config(0, SKLM=sklm), FRAMES, TARGET_SIZE)
+
+    # The single-precision path tracks the synthetic target to about 1 px.
+    assert result["error_mean"] < 1.5
+    assert result["error_max"] < 4.0
+
+
+@pytest.mark.parametrize("sklm", ["incremental", "reference"])
+def test_tracker_state_is_float32(sklm):
+    tracker, estimates = track(create_config(0, SKLM=sklm))
+
+    assert estimates.dtype == np.float32
+    assert tracker.is_single_precision()
+    assert tracker.get_basis_size() > 0
+
+
+def test_seeded_runs_are_identical():
+    _, first = track(create_config(3), frames=60)
+    _, second = track(create_config(3), frames=60)
+    _, other = track(create_config(4), frames=60)
+
+    assert np.array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+
+def test_check_float32_names_promoted_array():
+    with pytest.raises(AssertionError, match="basis is float64"):
+        check_float32(mean=np.zeros(2, dtype=np.float32), basis=np.zeros(2))
+
+
+def create_particles(rng, count, image_shape, angle=0.0, margin=60):
+    height, width = image_shape
+    params = np.zeros((count, 6), dtype=np.float32)
+
+    params[:, 0] = rng.uniform(margin, width - margin, count)
+    params[:, 1] = rng.uniform(margin, height - margin, count)
+    params[:, 2] = rng.uniform(0.8, 2.0, count)
+    params[:, 3] = rng.uniform(0.8, 1.2, count)
+    params[:, 4] = rng.uniform(-angle, angle, count)
+
+    return params
+
+
+@pytest.mark.parametrize("image_name", ["frame", "smooth"])
+@pytest.mark.parametrize("particle_set", ["aligned", "out_of_frame", "rotated", "mixed"])
+def test_batched_warp_matches_reference(image_name, particle_set):
+    rng = np.random.default_rng(0)
+
+    if image_name == "frame":
+        image = normalize_grayscale(SyntheticVideo((480, 320), TARGET_SIZE, 1.0, 0).lease().image)
+    else:
+        image = cv2.GaussianBlur(rng.random((320, 480), dtype=np.float32), (0, 0), 3)
+
+    aligned = create_particles(rng, 100, image.shape)
+    out_of_frame = create_particles(rng, 100, image.shape, margin=-10)
+    rotated = create_particles(rng, 100, image.shape, angle=0.5)
+
+    params = {
+        "aligned": aligned,
+        "out_of_frame": out_of_frame,
+        "rotated": rotated,
+        "mixed": np.concatenate([aligned[:50], rotated[:50], out_of_frame[:50]]),
+    }[particle_set]
+
+    template_shape = (32, 32)
+    dimension = template_shape[0] * template_shape[1]
+    out = np.empty((dimension, len(params)), dtype=np.float32)
+    maps = (np.empty_like(out), np.empty_like(out))
+
+    warped = warp_multiple_images(image, params, template_shape, out=out, maps=maps)
+    reference = np.stack([warp_image(image, param, template_shape) for param in params], axis=2)
+
+    assert warped.shape == (*template_shape, len(params))
+    assert np.shares_memory(warped, out)
+
+    # Documented tolerances: 1/32 of the intensity step between neighboring
+    # pixels for axis-aligned particles, twice that step for rotated ones.
+    step = max(np.max(np.abs(np.diff(image, axis=0))), np.max(np.abs(np.diff(image, axis=1))))
+    tolerance = np.where(np.abs(params[:, 4]) > 1e-5, 2 * step, step / 32 + 1e-6)
+
+    error = np.max(np.abs(warped - reference), axis=(0, 1))
+    assert np.all(error <= tolerance)
+
+
+def test_incremental_sklm_matches_reference():
+    rng = np.random.default_rng(0)
+    dimension = TRACKER_CONFIG["TEMPLATE_SIZE"] ** 2
+    max_basis = TRACKER_CONFIG["MAX_BASIS"]
+    batch_size = TRACKER_CONFIG["BATCH_SIZE"]
+    forgetting = TRACKER_CONFIG["FORGETTING"]
+
+    # Batches around a mean with a decaying spectrum, so the leading
+    # eigenvectors are well separated.
+    rank = max_basis + 4
+    components = np.linalg.qr(rng.standard_normal((dimension, rank)))[0].astype(np.float32)
+    scales = np.float32(2.0) ** -np.arange(rank, dtype=np.float32)
+    mean = rng.random(dimension, dtype=np.float32)
+
+    def create_template():
+        return {
+            "basis": np.zeros((dimension, 0), dtype=np.float32),
+            "eigval": np.array([], dtype=np.float32),
+            "mean": np.zeros(dimension, dtype=np.float32),
+            "nsamples": 0,
+        }
+
+    engine = IncrementalSKLM(dimension, max_basis, batch_size, forgetting)
+    template = create_template()
+    reference = create_template()
+
+    for _ in range(8):
+        coefficients = rng.standard_normal((batch_size, rank)).astype(np.float32) * scales
+        noise = 1e-3 * rng.standard_normal((batch_size, dimension)).astype(np.float32)
+        data_list = list(mean + coefficients @ components.T + noise)
+
+        # The engine returns views into its workspace, overwritten by the next update.
+        basis, eigval, mean_vector, nsamples, _ = engine.update(data_list, template)
+        template = {"basis": basis.copy(), "eigval": eigval.copy(), "mean": mean_vector.copy(), "nsamples": nsamples}
+
+        basis, eigval, mean_vector, nsamples = sklm(data_list, reference, forgetting)
+        reference = {"basis": basis[:, :max_basis], "eigval": eigval[:max_basis], "mean": mean_vector, "nsamples": nsamples}
+
+        assert template["basis"].shape == reference["basis"].shape
+        assert template["nsamples"] == pytest.approx(reference["nsamples"])
+        np.testing.assert_allclose(template["eigval"], reference["eigval"], rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(template["mean"], reference["mean"], atol=1e-6)
+
+        # Eigenvectors agree up to sign.
+        alignment = np.abs(np.diag(template["basis"].T @ reference["basis"]))
+        np.testing.assert_allclose(alignment, 1.0, atol=2e-3)